@@ -0,0 +1,265 @@
+"""
+Query search without Qt: the count and filter modes of the Query Search widget as functions, and a command line
+interface to run queries or a dictionary on a saved corpus, e.g. in batch jobs on compute nodes:
+
+    orange3-sma-query corpus.pkl counts.pkl --dictionary dictionary.csv --workers 8
+"""
+import argparse
+import logging
+import re
+import sys
+from collections import namedtuple
+
+import numpy as np
+from Orange.data import Table, Domain, ContinuousVariable, TimeVariable
+from progressmonitor import ProgressMonitor, NullMonitor
+
+from orangecontrib.sma.fields import BUCKET_INTERVALS, check_condition, field_kind
+from orangecontrib.sma.index import get_index, attach_subset_index, SearchCancelled
+
+log = logging.getLogger(__name__)
+
+# maximum time spent on a preview search (in seconds)
+PREVIEW_SECONDS = 5
+
+# result of count_queries: the documents with their query counts, the unmatched documents (None if they are
+# included in sample), the hits per period (if a date field was given) and which queries were completed
+CountResult = namedtuple("CountResult", ["sample", "remaining", "time_series", "completed"])
+# result of filter_queries: the matching and the other documents, and the Preview if only a preview was made
+FilterResult = namedtuple("FilterResult", ["sample", "remaining", "preview"])
+
+
+def parse_query(string):
+    m = re.match("([^#]*\w)#(.*)", string)
+    l, q = m.groups() if m else [string, string]
+    return l.strip(), q.strip()
+
+
+def parse_field_filters(string):
+    """Parse field filters of the form 'field=value1,value2; field2=value' into a dict of {field: [values]}"""
+    filters = {}
+    for part in string.split(";"):
+        if not part.strip():
+            continue
+        if "=" not in part:
+            raise ValueError("Invalid field filter {!r}, use field=value1,value2".format(part.strip()))
+        name, values = part.split("=", 1)
+        filters[name.strip()] = [v.strip() for v in values.split(",") if v.strip()]
+    return filters
+
+
+def check_filters(corpus, filters):
+    """
+    Check that the fields of the filters are variables of the corpus, and convert the values of numeric and date
+    fields (see fields.check_condition)
+    :raises ValueError: for an unknown field or an invalid value
+    """
+    checked = {}
+    for name, condition in filters.items():
+        if name not in corpus.domain:
+            raise ValueError("Unknown field {!r}".format(name))
+        try:
+            checked[name] = check_condition(field_kind(corpus.domain[name]), condition)
+        except ValueError as e:
+            raise ValueError("Field {!r}: {}".format(name, e)) from None
+    return checked
+
+
+def bucket_table(buckets, labels):
+    """Create a table with the start, the number of documents and the query hits of each time bucket"""
+    domain = Domain([TimeVariable("Period", have_date=True), ContinuousVariable("Documents")] +
+                    [ContinuousVariable(label) for label in labels])
+    X = np.column_stack([buckets.starts, buckets.n_docs, buckets.counts])
+    return Table.from_numpy(domain, X)
+
+
+def _remaining(corpus, selected):
+    o = np.ones(len(corpus))
+    o[selected] = 0
+    remaining = np.nonzero(o)[0]
+    return attach_subset_index(corpus, corpus[remaining], remaining)
+
+
+def count_queries(corpus, queries, monitor: ProgressMonitor = None, should_break=None, workers=1,
+                  include_unmatched=False, sparse=False, filters=None, date_field=None, interval="week",
+                  **kargs) -> CountResult:
+    """
+    Count the (weighted) hits of each query in each document, as the count mode of Query Search.
+    If the search is stopped by should_break, the counts of the completed queries are returned.
+
+    :param queries: query strings, optionally labeled as 'label# query'. The labels are the names of the count columns
+    :param workers: number of worker processes used to build and search the index
+    :param include_unmatched: if True, sample contains all documents, otherwise only documents matching a query
+    :param sparse: add the counts to the corpus as sparse features
+    :param filters: only count documents matching these field filters, see BaseIndex.add_fields
+    :param date_field: if given, also count the hits per interval ("day", "week", "month" or "year") of this field
+    :param kargs: passed to get_index, e.g. engine or cache
+    """
+    monitor = monitor or NullMonitor()
+    filters = filters or {}
+    fields = list(filters) + [date_field] if date_field else list(filters)
+    index = get_index(corpus, monitor=monitor.submonitor(50), procs=workers, workers=workers,
+                      positions=any('"' in q for q in queries), fields=fields, **kargs)
+    parsed = [parse_query(q) for q in queries]
+    completed = np.ones(len(parsed), dtype=bool)
+    try:
+        counts = index.search_many([q for _label, q in parsed], monitor=monitor.submonitor(50),
+                                   should_break=should_break, filters=filters)
+    except SearchCancelled as e:
+        # use the counts of the queries that were completed before the search was stopped
+        completed = e.completed
+        parsed = [p for p, done in zip(parsed, completed) if done]
+        counts = e.partial[:, completed].tocsr()
+    sample = corpus.copy()
+    # add all count columns at once, as each extend_attributes copies the features of the corpus
+    labels = [label for label, _q in parsed]
+    if labels:
+        if sparse:
+            sample.extend_attributes(counts, labels, sparse=True)
+        else:
+            sample.extend_attributes(counts.toarray(), labels)
+    time_series = None
+    if date_field:
+        time_series = bucket_table(index.aggregate_buckets(counts, date_field, interval, filters=filters), labels)
+    if include_unmatched:
+        return CountResult(attach_subset_index(corpus, sample, ...), None, time_series, completed)
+    # documents with at least one matching query are stored entries in the counts matrix
+    selected = np.flatnonzero(np.diff(counts.indptr))
+    sample = attach_subset_index(corpus, sample[selected], selected)
+    return CountResult(sample, _remaining(corpus, selected), time_series, completed)
+
+
+def filter_queries(corpus, queries, monitor: ProgressMonitor = None, should_break=None, context_window=None,
+                   preview=None, filters=None, workers=1, **kargs) -> FilterResult:
+    """
+    Select the documents matching any of the queries, as the filter mode of Query Search.
+    Raises SearchCancelled if the search is stopped by should_break.
+
+    :param queries: query strings, optionally labeled as 'label# query' (the labels are ignored)
+    :param context_window: if given, the tokens of the sample are only the words within this window of the matches
+    :param preview: if given, only get (at most) this number of matching documents, searching for at most
+                    PREVIEW_SECONDS (see BaseIndex.preview). The context window is then ignored
+    :param filters: only select documents matching these field filters, see BaseIndex.add_fields
+    :param workers: number of worker processes used to build and search the index
+    :param kargs: passed to get_index, e.g. engine or cache
+    """
+    monitor = monitor or NullMonitor()
+    filters = filters or {}
+    # phrases and context windows need term positions, otherwise a compact index is sufficient
+    positions = bool(context_window and not preview) or any('"' in q for q in queries)
+    index = get_index(corpus, monitor=monitor.submonitor(50), procs=workers, workers=workers,
+                      positions=positions, fields=list(filters), **kargs)
+    query = " OR ".join('({})'.format(parse_query(q)[1]) for q in queries)
+    result = None
+    if preview:
+        # the first matching documents, stopping after preview hits or PREVIEW_SECONDS
+        result = index.preview(query, k=preview, time_budget=PREVIEW_SECONDS, filters=filters)
+        selected = result.rows
+        sample = attach_subset_index(corpus, corpus[selected], selected)
+    elif not context_window:
+        selected = index.search_rows(query, should_break=should_break, filters=filters)
+        sample = attach_subset_index(corpus, corpus[selected], selected)
+    else:
+        # the context tokens are sliced lazily from the corpus tokens, so they are not copied
+        context = index.context_tokens(query, int(context_window), filters=filters)
+        selected = context.rows
+        sample = corpus[selected]
+        sample._tokens = context
+    return FilterResult(sample, _remaining(corpus, selected), result)
+
+
+def read_dictionary(filename, label_col="label", query_col="query", weight_col=None, add_quotes=True):
+    """
+    Read the queries of a dictionary table (as imported by the Dictionary widget) as 'label# query' strings
+    """
+    from orangecontrib.sma.dictionary import Dictionary
+    dictionary = Dictionary(Table.from_file(filename))
+    return [label.strip() + '# ' + query.strip() if label else query.strip()
+            for label, query in dictionary.import_dictionary(label_col, query_col, weight_col, add_quotes)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="orange3-sma-query",
+        description="Search a saved corpus with queries or a dictionary and write the result table")
+    parser.add_argument("corpus", help="corpus file, e.g. a corpus pickled (.pkl) by Orange")
+    parser.add_argument("output", help="file to write the result to, in the format of its extension (.tab, .csv, .pkl)")
+    parser.add_argument("-q", "--query", action="append", default=[],
+                        help="query, optionally labeled as 'label# query' (can be repeated)")
+    parser.add_argument("-d", "--dictionary", help="table with a dictionary, as imported by the Dictionary widget")
+    parser.add_argument("--label-column", default="label", help="label column of the dictionary")
+    parser.add_argument("--query-column", default="query", help="query column of the dictionary")
+    parser.add_argument("--weight-column", help="weight column of the dictionary")
+    parser.add_argument("--no-quotes", action="store_true",
+                        help="do not quote dictionary queries of multiple words as phrases")
+    parser.add_argument("-m", "--mode", choices=["count", "filter"], default="count")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of worker processes to build and search the index")
+    parser.add_argument("--include-unmatched", action="store_true",
+                        help="count mode: also output the documents that do not match any query")
+    parser.add_argument("--sparse", action="store_true", help="count mode: output the counts as sparse features")
+    parser.add_argument("--context-window", type=int,
+                        help="filter mode: only output the words within this window of the matches")
+    parser.add_argument("--filter", action="append", default=[],
+                        help="only search documents with these meta values, e.g. 'Medium=NRC,Trouw'")
+    parser.add_argument("--date-field", help="date meta used by --date-from, --date-to and --time-series")
+    parser.add_argument("--date-from", help="first date (inclusive) of the documents to search, e.g. 2018-01-01")
+    parser.add_argument("--date-to", help="last date (exclusive) of the documents to search")
+    parser.add_argument("--time-series", help="count mode: also write the hits per period of the date field here")
+    parser.add_argument("--interval", choices=BUCKET_INTERVALS, default="week", help="period of --time-series")
+    parser.add_argument("--remaining", help="also write the documents that were not selected here")
+    parser.add_argument("--engine", choices=["whoosh", "numpy", "sharded"], default="whoosh", help="index engine")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the persistent index cache")
+    parser.add_argument("-v", "--verbose", action="store_true", help="report progress")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="[%(asctime)s %(levelname)s] %(message)s")
+    queries = list(args.query)
+    if args.dictionary:
+        queries += read_dictionary(args.dictionary, args.label_column, args.query_column, args.weight_column,
+                                   not args.no_quotes)
+    if not queries:
+        parser.error("Please provide a query (--query) or a dictionary (--dictionary)")
+    if (args.time_series or args.date_from or args.date_to) and not args.date_field:
+        parser.error("--time-series, --date-from and --date-to need a --date-field")
+    if args.mode == "filter" and (args.time_series or args.include_unmatched or args.sparse):
+        parser.error("--time-series, --include-unmatched and --sparse can only be used in count mode")
+    if args.mode == "count" and args.context_window:
+        parser.error("--context-window can only be used in filter mode")
+    filters = {}
+    for f in args.filter:
+        try:
+            filters.update(parse_field_filters(f))
+        except ValueError as e:
+            parser.error(str(e))
+    if args.date_from or args.date_to:
+        filters[args.date_field] = (args.date_from, args.date_to)
+
+    from orangecontrib.text.corpus import Corpus
+    corpus = Corpus.from_file(args.corpus)
+    try:
+        filters = check_filters(corpus, filters)
+    except ValueError as e:
+        parser.error(str(e))
+    log.info("Searching {} queries in {} documents".format(len(queries), len(corpus)))
+    index_args = dict(filters=filters, workers=args.workers, engine=args.engine, cache=not args.no_cache)
+    with ProgressMonitor().task(100, "Searching") as monitor:
+        if args.verbose:
+            monitor.add_listener(lambda m: log.info("{:.0%} {}".format(m.progress, m.message)))
+        if args.mode == "count":
+            result = count_queries(corpus, queries, monitor, include_unmatched=args.include_unmatched,
+                                   sparse=args.sparse, date_field=args.time_series and args.date_field,
+                                   interval=args.interval, **index_args)
+            if args.time_series:
+                result.time_series.save(args.time_series)
+        else:
+            result = filter_queries(corpus, queries, monitor, context_window=args.context_window, **index_args)
+    result.sample.save(args.output)
+    if args.remaining and result.remaining is not None:
+        result.remaining.save(args.remaining)
+    print("Wrote {} documents to {}".format(len(result.sample), args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Compressed bitmaps of document (row) numbers, used to evaluate boolean queries as set operations.
+
+Like roaring bitmaps, the rows are divided in chunks of 2^16 rows by their high bits. The low bits of the rows in a
+chunk are stored either as a sorted uint16 array (if there are at most ARRAY_MAX rows in the chunk) or as a packed
+bitset of 2^16 bits (uint8 array of 8192 bytes), whichever is smaller.
+"""
+import numpy as np
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+# chunks with more rows are stored as bitsets (which take 8192 bytes, i.e. 4096 uint16 values)
+ARRAY_MAX = 4096
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def _is_array(c):
+    return c.dtype == np.uint16
+
+
+def _cardinality(c):
+    return len(c) if _is_array(c) else int(_POPCOUNT[c].sum())
+
+
+def _dense(c):
+    """Get the chunk as a boolean array of CHUNK_SIZE"""
+    if _is_array(c):
+        b = np.zeros(CHUNK_SIZE, dtype=bool)
+        b[c] = True
+        return b
+    return np.unpackbits(c).view(bool)
+
+
+def _compact(b):
+    """Store the boolean array of a chunk in the smallest container, or return None if it is empty"""
+    n = int(np.count_nonzero(b))
+    if n == 0:
+        return None
+    if n <= ARRAY_MAX:
+        return np.flatnonzero(b).astype(np.uint16)
+    return np.packbits(b)
+
+
+def _and(x, y):
+    if _is_array(x) and _is_array(y):
+        result = np.intersect1d(x, y, assume_unique=True)
+    elif _is_array(x) or _is_array(y):
+        a, b = (x, y) if _is_array(x) else (y, x)
+        result = a[np.unpackbits(b).view(bool)[a]]
+    else:
+        return _compact(np.unpackbits(x & y).view(bool))
+    return result if len(result) else None
+
+
+def _andnot(x, y):
+    if _is_array(x):
+        result = x[~_dense(y)[x]]
+        return result if len(result) else None
+    if _is_array(y):
+        b = _dense(x).copy()
+        b[y] = False
+        return _compact(b)
+    return _compact(np.unpackbits(x & ~y).view(bool))
+
+
+def _union(containers):
+    if len(containers) == 1:
+        return containers[0]
+    if all(_is_array(c) for c in containers) and sum(len(c) for c in containers) <= ARRAY_MAX:
+        return np.unique(np.concatenate(containers))
+    b = np.zeros(CHUNK_SIZE, dtype=bool)
+    for c in containers:
+        if _is_array(c):
+            b[c] = True
+        else:
+            b |= np.unpackbits(c).view(bool)
+    return _compact(b)
+
+
+class Bitmap(object):
+    """Compressed set of non-negative integers (rows), see the module documentation"""
+
+    def __init__(self, chunks=None):
+        # {high bits: container}, never containing empty containers
+        self.chunks = chunks or {}
+
+    @classmethod
+    def from_array(cls, rows) -> 'Bitmap':
+        """Create a bitmap from an array of rows"""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        keys, first = np.unique(rows >> CHUNK_BITS, return_index=True)
+        chunks = {}
+        for key, low in zip(keys.tolist(), np.split((rows & (CHUNK_SIZE - 1)).astype(np.uint16), first[1:])):
+            chunks[key] = low if len(low) <= ARRAY_MAX else np.packbits(_dense(low))
+        return cls(chunks)
+
+    @classmethod
+    def full(cls, n) -> 'Bitmap':
+        """Create the bitmap of all rows in range(n)"""
+        chunks = {}
+        for key in range((n + CHUNK_SIZE - 1) // CHUNK_SIZE):
+            b = np.zeros(CHUNK_SIZE, dtype=bool)
+            b[:min(CHUNK_SIZE, n - key * CHUNK_SIZE)] = True
+            chunks[key] = _compact(b)
+        return cls(chunks)
+
+    @classmethod
+    def union(cls, bitmaps) -> 'Bitmap':
+        """Get the union of any number of bitmaps, combining the containers of each chunk at once"""
+        by_key = {}
+        for bitmap in bitmaps:
+            for key, c in bitmap.chunks.items():
+                by_key.setdefault(key, []).append(c)
+        return cls({key: _union(containers) for key, containers in by_key.items()})
+
+    def to_array(self) -> np.ndarray:
+        """Get the sorted array of rows"""
+        parts = []
+        for key in sorted(self.chunks):
+            c = self.chunks[key]
+            low = c if _is_array(c) else np.flatnonzero(np.unpackbits(c))
+            parts.append((key << CHUNK_BITS) + low.astype(np.int64))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def _combine(self, other, op, keys):
+        chunks = {}
+        for key in keys:
+            c = op(self.chunks[key], other.chunks[key])
+            if c is not None:
+                chunks[key] = c
+        return Bitmap(chunks)
+
+    def __and__(self, other: 'Bitmap') -> 'Bitmap':
+        return self._combine(other, _and, self.chunks.keys() & other.chunks.keys())
+
+    def __or__(self, other: 'Bitmap') -> 'Bitmap':
+        return Bitmap.union([self, other])
+
+    def __sub__(self, other: 'Bitmap') -> 'Bitmap':
+        result = self._combine(other, _andnot, self.chunks.keys() & other.chunks.keys())
+        result.chunks.update((key, c) for key, c in self.chunks.items() if key not in other.chunks)
+        return result
+
+    def __len__(self):
+        return sum(_cardinality(c) for c in self.chunks.values())
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for c in self.chunks.values())
@@ -0,0 +1,194 @@
+"""
+Fast counting of simple dictionaries: queries that are (OR-ed) plain terms and quoted phrases with an optional
+^weight, such as most queries created by Dictionary.import_dictionary (e.g. 'tax^2 OR "income tax"^0.5').
+
+All terms and phrases of all queries are stored in one trie of term ids, which is matched against every position
+of the corpus tokens in a vectorized scan: at depth d, the positions that are still in the trie advance one token,
+so the work is proportional to the number of tokens plus the number of partial matches. The documents are scanned
+in chunks of about CHUNK_TOKENS tokens, with the tokens mapped to int32 ids of the dictionary words, so the memory
+used is bounded (about SCAN_BYTES_PER_TOKEN per token of a chunk) and does not grow with the corpus.
+The counts are the same as those of the index path (BaseIndex.search_many): the weighted number of occurrences of
+the terms and phrases of each query.
+"""
+import re
+
+import numpy as np
+
+# whoosh query syntax that is not a plain term: fields, wildcards, groups, ranges, boosts, slop and quotes
+_TERM = r"[^\s\"'()\[\]{}:^*?~]+"
+_PART = re.compile(r'\s*(?:"([^"]*)"|({}))(?:\^(\d+(?:\.\d+)?|\.\d+))?\s*$'.format(_TERM))
+_OPERATORS = {"AND", "OR", "NOT", "ANDNOT", "ANDMAYBE", "TO"}
+
+# number of tokens scanned at once, and the estimated peak memory of the scan per token of a chunk
+CHUNK_TOKENS = 1 << 20
+SCAN_BYTES_PER_TOKEN = 48
+
+
+def parse_simple_query(query: str):
+    """
+    Parse a query consisting of terms and quoted phrases (with optional ^weight) joined by OR
+    :return: list of (words, weight) pairs, or None if the query uses other query syntax
+    """
+    patterns = []
+    for part in re.split(r"\s+OR\s+", query.strip()):
+        m = _PART.match(part)
+        if not m:
+            return None
+        phrase, term, weight = m.groups()
+        words = tuple(phrase.split()) if phrase is not None else (term,)
+        if not words or (phrase is None and term in _OPERATORS):
+            return None
+        # like the whoosh parser, which turns a quoted single word into a term without the boost of the phrase
+        if weight is None or (phrase is not None and len(words) == 1):
+            weight = 1.0
+        patterns.append((words, float(weight)))
+    return patterns
+
+
+class PhraseTrie(object):
+    """Trie of sequences of term ids, with the (query, weight) outputs of the sequence ending in each node"""
+
+    def __init__(self, n_terms):
+        self.n_terms = n_terms
+        self._children = {}  # {(node, term id): child node}, node 0 is the root
+        self._outputs = []  # (node, query, weight)
+        self.n_nodes = 1
+
+    def add(self, term_ids, query, weight):
+        node = 0
+        for t in term_ids:
+            child = self._children.get((node, t))
+            if child is None:
+                child = self._children[node, t] = self.n_nodes
+                self.n_nodes += 1
+            node = child
+        self._outputs.append((node, query, weight))
+
+    def arrays(self):
+        """
+        Get the trie as arrays: the sorted transition keys (node * n_terms + term id) and their child nodes, and the
+        outputs of node i as out_query[out_ptr[i]:out_ptr[i+1]] and out_weight[out_ptr[i]:out_ptr[i+1]]
+        """
+        keys = np.array([node * self.n_terms + t for node, t in self._children], dtype=np.int64)
+        children = np.array(list(self._children.values()), dtype=np.int64)
+        order = np.argsort(keys)
+        outputs = sorted(self._outputs)
+        out_node = np.array([o[0] for o in outputs], dtype=np.int64)
+        out_ptr = np.searchsorted(out_node, np.arange(self.n_nodes + 1))
+        out_query = np.array([o[1] for o in outputs], dtype=np.int64)
+        out_weight = np.array([o[2] for o in outputs], dtype=float)
+        return keys[order], children[order], out_ptr, out_query, out_weight
+
+    def match(self, token_ids, doc_ptr, arrays=None):
+        """
+        Find all occurrences of the sequences in the documents
+        :param arrays: the result of arrays(), if already computed
+        :return: (doc, node) arrays of the occurrences, for the nodes that have outputs
+        """
+        keys, children, out_ptr, _query, _weight = arrays or self.arrays()
+        terminal = np.diff(out_ptr) > 0
+        children = children.astype(np.int32)
+        lengths = np.diff(doc_ptr)
+        # int32 positions and states: the token ids are scanned in chunks (see dictionary_frequencies)
+        doc_of = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+        end_of = np.repeat(doc_ptr[1:].astype(np.int32), lengths)
+        pos = np.arange(len(token_ids), dtype=np.int32)
+        state = np.zeros(len(pos), dtype=np.int32)
+        hit_doc, hit_node = [], []
+        depth = 0
+        while len(pos) and len(keys):
+            inside = pos + depth < end_of[pos]
+            pos, state = pos[inside], state[inside]
+            key = state.astype(np.int64) * self.n_terms + token_ids[pos + depth]
+            j = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            found = keys[j] == key
+            pos, state = pos[found], children[j[found]]
+            ends = terminal[state]
+            hit_doc.append(doc_of[pos[ends]])
+            hit_node.append(state[ends])
+            depth += 1
+        empty = np.empty(0, dtype=np.int32)
+        return np.concatenate(hit_doc or [empty]), np.concatenate(hit_node or [empty])
+
+
+def document_chunks(lengths, max_tokens=CHUNK_TOKENS):
+    """
+    Divide the documents with the given lengths into ranges of documents with at most max_tokens tokens
+    (or a single, longer document)
+    :return: list of (start, end) document ranges
+    """
+    ends = np.cumsum(lengths)
+    chunks = []
+    start = 0
+    while start < len(lengths):
+        offset = ends[start - 1] if start else 0
+        end = max(start + 1, int(np.searchsorted(ends, offset + max_tokens, side="right")))
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def dictionary_frequencies(patterns, tokens, interned=None, chunk_tokens=CHUNK_TOKENS, check=None):
+    """
+    Count the simple queries (see parse_simple_query) in the tokens
+    :param patterns: for each query, the list of (words, weight) pairs
+    :param tokens: the tokens of each document
+    :param interned: the (terms, token_ids, doc_ptr) arrays of the tokens (see index.intern_tokens), if available
+    :param chunk_tokens: the (approximate) number of tokens scanned at once
+    :param check: function called before scanning each chunk, e.g. to check for cancellation
+    :return: list of (rows, frequencies) pairs of arrays, one per query
+    """
+    # the words of the dictionary get ids 0..n-1, all other tokens id n (for which the trie has no transitions)
+    words = {}
+    trie_args = []
+    for query, query_patterns in enumerate(patterns):
+        for phrase, weight in query_patterns:
+            trie_args.append(([words.setdefault(w, len(words)) for w in phrase], query, weight))
+    other = len(words)
+    trie = PhraseTrie(other + 1)
+    for args in trie_args:
+        trie.add(*args)
+    arrays = trie.arrays()
+    if interned is not None:
+        terms, token_ids, doc_ptr = interned
+        lookup = np.full(len(terms), other, dtype=np.int32)
+        for w, i in words.items():
+            j = np.searchsorted(terms, w)
+            if j < len(terms) and terms[j] == w:
+                lookup[j] = i
+        lengths = np.diff(doc_ptr)
+    else:
+        lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    n_docs = len(lengths)
+    hit_doc, hit_node = [], []
+    for start, end in document_chunks(lengths, chunk_tokens):
+        if check is not None:
+            check()
+        if interned is not None:
+            ids = lookup[token_ids[doc_ptr[start]:doc_ptr[end]]]
+        else:
+            ids = np.fromiter((words.get(t, other) for doc_tokens in tokens[start:end] for t in doc_tokens),
+                              dtype=np.int32, count=int(lengths[start:end].sum()))
+        chunk_ptr = np.concatenate([[0], np.cumsum(lengths[start:end])])
+        doc, node = trie.match(ids, chunk_ptr, arrays)
+        hit_doc.append(doc.astype(np.int64) + start)
+        hit_node.append(node.astype(np.int64))
+    doc = np.concatenate(hit_doc or [np.empty(0, dtype=np.int64)])
+    node = np.concatenate(hit_node or [np.empty(0, dtype=np.int64)])
+    # count the occurrences per (node, document), then distribute them over the queries of each node
+    pairs, counts = np.unique(node * n_docs + doc, return_counts=True)
+    node, doc = pairs // n_docs, pairs % n_docs
+    _keys, _children, out_ptr, out_query, out_weight = arrays
+    n_out = out_ptr[node + 1] - out_ptr[node]
+    out = np.repeat(out_ptr[node] - (np.cumsum(n_out) - n_out), n_out) + np.arange(n_out.sum())
+    query = out_query[out]
+    doc = np.repeat(doc, n_out)
+    weights = out_weight[out] * np.repeat(counts, n_out)
+    # sum per (query, document)
+    keys = query * n_docs + doc
+    order = np.argsort(keys, kind="stable")
+    pairs, starts = np.unique(keys[order], return_index=True)
+    sums = np.add.reduceat(weights[order], starts) if len(pairs) else np.empty(0)
+    query, doc = pairs // n_docs, pairs % n_docs
+    bounds = np.searchsorted(query, np.arange(len(patterns) + 1))
+    return [(doc[bounds[q]:bounds[q + 1]], sums[bounds[q]:bounds[q + 1]]) for q in range(len(patterns))]
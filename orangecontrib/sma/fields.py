@@ -0,0 +1,203 @@
+"""
+Metadata fields of indexed documents (e.g. publication date or medium), used to filter search results without
+slicing (and reindexing) the corpus.
+
+The values of a field are stored per document in an array: dates (as seconds since the epoch, as in Orange's
+TimeVariable) and numbers as floats, keywords as integer codes into the sorted array of distinct values.
+Filters are given as a dict of {field name: condition}:
+
+- keyword fields: a value or a collection of values, e.g. {"Medium": ["NRC", "Trouw"]}
+- numeric and date fields: a value, a list of values, or a (low, high) pair with low inclusive and high exclusive,
+  either of which can be None. Numbers can also be given as strings, and dates as ISO strings, dates, datetimes
+  or timestamps, e.g. {"Publication Date": ("2018-01-01", "2018-02-01")} or {"Year": ["2017", "2018"]}
+
+Date fields can also be divided in time buckets (days, weeks starting on Monday, months or years), see
+FieldIndex.buckets, to aggregate search results into time series.
+"""
+import datetime
+
+import numpy as np
+
+FIELD_KINDS = ("numeric", "date", "keyword")
+BUCKET_INTERVALS = ("day", "week", "month", "year")
+
+
+def to_timestamp(value) -> float:
+    """Convert an ISO date(time) string, date, datetime or number to seconds since the epoch"""
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.timestamp()
+    delta = np.datetime64(value) - np.datetime64("1970-01-01T00:00:00")
+    return float(delta / np.timedelta64(1, "s"))
+
+
+def time_buckets(timestamps, interval):
+    """
+    Divide timestamps in consecutive time buckets
+    :param timestamps: array of seconds since the epoch (nan for missing values)
+    :param interval: "day", "week", "month" or "year"
+    :return: a pair of arrays: the bucket of each timestamp (-1 for missing values), and the start of each bucket
+             (as seconds since the epoch), including empty buckets between the first and last one
+    """
+    if interval not in BUCKET_INTERVALS:
+        raise ValueError("Unknown interval {!r}, should be one of {}".format(interval, BUCKET_INTERVALS))
+    valid = ~np.isnan(timestamps)
+    dates = np.floor(timestamps[valid]).astype(np.int64).astype("datetime64[s]")
+    if interval == "week":
+        # the epoch is a thursday, so weeks (starting on monday) are counted from 1969-12-29
+        units = (dates.astype("datetime64[D]").astype(np.int64) + 3) // 7
+    else:
+        unit = {"day": "D", "month": "M", "year": "Y"}[interval]
+        units = dates.astype("datetime64[{}]".format(unit)).astype(np.int64)
+    codes = np.full(len(timestamps), -1, dtype=np.int64)
+    if not len(units):
+        return codes, np.empty(0)
+    first = units.min()
+    codes[valid] = units - first
+    starts = np.arange(first, units.max() + 1)
+    if interval == "week":
+        starts = (starts * 7 - 3).astype("datetime64[D]")
+    else:
+        starts = starts.astype("datetime64[{}]".format(unit))
+    return codes, starts.astype("datetime64[s]").astype(np.int64).astype(float)
+
+
+def check_condition(kind, condition):
+    """
+    Convert the values of a filter condition (see the module documentation) for a field of the given kind,
+    e.g. the strings of parsed field filters to numbers or timestamps
+    :return: the condition with numeric and date values as floats
+    :raises ValueError: if a value cannot be converted
+    """
+    if kind == "keyword":
+        return condition
+    convert = to_timestamp if kind == "date" else float
+
+    def value(v):
+        try:
+            return convert(v)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid value {!r} for a {} field".format(v, kind)) from None
+
+    if isinstance(condition, tuple):
+        if len(condition) != 2:
+            raise ValueError("A range of a {} field should be a (low, high) pair, not {!r}".format(kind, condition))
+        return tuple(None if v is None else value(v) for v in condition)
+    if isinstance(condition, str) or not hasattr(condition, "__iter__"):
+        return value(condition)
+    return [value(v) for v in condition]
+
+
+class FieldIndex(object):
+    """The values of one field for all documents, see the module documentation"""
+
+    def __init__(self, kind, values, categories=None):
+        """
+        :param kind: "numeric", "date" or "keyword"
+        :param values: array of values; for keyword fields the codes into categories (-1 for missing values)
+        :param categories: sorted array of the keyword values
+        """
+        if kind not in FIELD_KINDS:
+            raise ValueError("Unknown field kind {!r}, should be one of {}".format(kind, FIELD_KINDS))
+        self.kind = kind
+        self.values = values
+        self.categories = categories
+        # {interval: (codes, starts)}, see buckets
+        self._buckets = {}
+
+    @classmethod
+    def from_values(cls, kind, values) -> 'FieldIndex':
+        """Create a field from the values of each document (None or nan for missing values)"""
+        if kind != "keyword":
+            return cls(kind, np.array([np.nan if v is None else v for v in values], dtype=float))
+        present = [v for v in values if v is not None and v == v]
+        categories = np.empty(len(set(present)), dtype=object)
+        categories[:] = sorted(set(present))
+        lookup = {v: i for i, v in enumerate(categories)}
+        return cls(kind, np.fromiter((lookup.get(v, -1) if v == v else -1 for v in values),
+                                     dtype=np.int64, count=len(values)), categories)
+
+    def __len__(self):
+        return len(self.values)
+
+    def matches(self, condition) -> np.ndarray:
+        """Get a boolean array telling which documents match the condition"""
+        if self.kind == "keyword":
+            if isinstance(condition, str) or not hasattr(condition, "__iter__"):
+                condition = [condition]
+            codes = np.searchsorted(self.categories, list(condition))
+            codes = [c for c, v in zip(codes.tolist(), condition)
+                     if c < len(self.categories) and self.categories[c] == v]
+            return np.isin(self.values, codes)
+        condition = check_condition(self.kind, condition)
+        if isinstance(condition, tuple):
+            low, high = condition
+            mask = ~np.isnan(self.values)
+            if low is not None:
+                mask &= self.values >= low
+            if high is not None:
+                mask &= self.values < high
+            return mask
+        if isinstance(condition, list):
+            return np.isin(self.values, condition)
+        return self.values == condition
+
+    def buckets(self, interval):
+        """
+        Get the time bucket of each document of a date field and the start of each bucket, see time_buckets.
+        The result is cached, so the arrays should not be changed
+        """
+        if self.kind != "date":
+            raise ValueError("Time buckets can only be computed for date fields, not {} fields".format(self.kind))
+        if interval not in self._buckets:
+            self._buckets[interval] = time_buckets(self.values, interval)
+        return self._buckets[interval]
+
+    def subset(self, rows) -> 'FieldIndex':
+        return FieldIndex(self.kind, self.values[rows], self.categories)
+
+
+def filter_mask(fields, filters, n_docs):
+    """
+    Get a boolean array telling which documents match all filters, or None if there are no filters
+    :param fields: dict of {name: FieldIndex}
+    """
+    if not filters:
+        return None
+    mask = np.ones(n_docs, dtype=bool)
+    for name, condition in filters.items():
+        if name not in fields:
+            raise ValueError("Field {!r} is not indexed, use get_index(..., fields=[{!r}])".format(name, name))
+        mask &= fields[name].matches(condition)
+    return mask
+
+
+def field_kind(var) -> str:
+    """Get the default field kind of a variable: date for time variables, numeric for continuous variables and
+    keyword for discrete and string variables"""
+    return "date" if var.is_time else "numeric" if var.is_continuous else "keyword"
+
+
+def corpus_fields(corpus, fields) -> dict:
+    """
+    Get the values of corpus variables (usually metas) as fields
+    :param fields: names of the variables, or a dict of {name: kind}, by default see field_kind
+    :return: dict of {name: FieldIndex}
+    """
+    if not isinstance(fields, dict):
+        fields = dict.fromkeys(fields)
+    result = {}
+    for name, kind in fields.items():
+        var = corpus.domain[name]
+        column = corpus.get_column_view(var)[0]
+        if kind is None:
+            kind = field_kind(var)
+        if var.is_discrete:
+            values = [None if np.isnan(v) else var.values[int(v)] for v in column.astype(float)]
+        elif var.is_string:
+            values = [None if v is None or v == "" else str(v) for v in column]
+        else:
+            values = column.astype(float)
+        result[name] = FieldIndex.from_values(kind, values)
+    return result
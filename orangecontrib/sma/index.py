@@ -1,118 +1,1961 @@
+import hashlib
+import logging
+import math
 import multiprocessing
+import os
+import shutil
+import re
+import time
 from tempfile import TemporaryDirectory
-from threading import Lock
-from collections import defaultdict
+from threading import Lock, Thread
+from uuid import uuid4
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from numbers import Integral
+from weakref import WeakSet, ref
 
-from progressmonitor import monitored, ProgressMonitor
-from whoosh import scoring
+import numpy as np
+import scipy.sparse as sp
+from progressmonitor import monitored, ProgressMonitor, NullMonitor
+from whoosh import query as wq, scoring
 from whoosh.analysis.tokenizers import SpaceSeparatedTokenizer
-from whoosh.index import create_in
+from whoosh.filedb.filestore import RamStorage
+from whoosh.index import create_in, exists_in, open_dir
 from whoosh.fields import *
 from whoosh.qparser.default import QueryParser
+from whoosh.writing import SegmentWriter
 from orangecontrib.text.corpus import Corpus
 
+from orangecontrib.sma.bitmap import Bitmap
+from orangecontrib.sma.dictionary_matcher import CHUNK_TOKENS, SCAN_BYTES_PER_TOKEN, dictionary_frequencies, \
+    parse_simple_query
+from orangecontrib.sma.fields import FieldIndex, corpus_fields, filter_mask
+
+log = logging.getLogger(__name__)
+
 _GLOBAL_LOCK = Lock()
+# protects the use counts of the indexes, see BaseIndex.in_use
+_USE_LOCK = Lock()
 
-class Index(object):
-    """Wrapper around a whoosh index"""
+# Increment if the schema or layout of the index changes, so old cached indices are not reused
+INDEX_VERSION = 1
+
+def index_schema(positions=True):
+    """
+    The whoosh schema of the index, also used to parse queries
+    :param positions: If False, only store the term frequencies (a compact index that cannot answer phrase queries)
+    """
+    return Schema(text=TEXT(stored=False, analyzer=SpaceSeparatedTokenizer(), phrase=positions),
+                  doc_i=NUMERIC(int, 64, signed=False, stored=True))
+
+
+def uses_positions(q) -> bool:
+    """Does the (parsed) query need term positions, i.e. does it contain phrase or proximity queries?"""
+    if isinstance(q, (wq.Phrase, wq.Sequence, wq.Ordered, wq.SpanQuery)):
+        return True
+    return not q.is_leaf() and any(uses_positions(child) for child in q.children())
+
+
+def intern_tokens(tokens):
+    """
+    Intern the tokens in a sorted vocabulary (so prefix queries are a range of term ids)
+    :return: (terms, token_ids, doc_ptr) arrays: the term ids of document d are token_ids[doc_ptr[d]:doc_ptr[d+1]]
+    """
+    vocabulary = {}
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    ids = np.fromiter((vocabulary.setdefault(t, len(vocabulary)) for doc_tokens in tokens for t in doc_tokens),
+                      dtype=np.int64, count=int(lengths.sum()))
+    terms = np.empty(len(vocabulary), dtype=object)
+    terms[:] = list(vocabulary)
+    order = np.argsort(terms, kind="stable")
+    remap = np.empty(len(order), dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return terms[order], remap[ids], np.concatenate([[0], np.cumsum(lengths)])
+
+
+def term_counts(terms, token_ids, doc_ptr):
+    """
+    Count the document and collection frequencies of the interned tokens (see intern_tokens)
+    :return: (docfreq, termfreq) arrays aligned with terms
+    """
+    termfreq = np.bincount(token_ids, minlength=len(terms))
+    # count each (document, term) pair once
+    doc = np.repeat(np.arange(len(doc_ptr) - 1), np.diff(doc_ptr))
+    pairs = np.unique(doc * len(terms) + token_ids)
+    docfreq = np.bincount(pairs % len(terms), minlength=len(terms)) if len(terms) else termfreq
+    return docfreq, termfreq
+
+
+def expand_ranges(start, end) -> np.ndarray:
+    """Get the concatenation of range(start[i], end[i]) for all i as an array"""
+    counts = np.maximum(end - start, 0)
+    ptr = np.concatenate([[0], np.cumsum(counts)])
+    return np.repeat(start - ptr[:-1], counts) + np.arange(ptr[-1])
+
+
+def association_scores(observed, window_size, frequency, total):
+    """
+    Get the expected window counts, pointwise mutual information and log-likelihood (G2) association scores of
+    terms occurring observed times in windows of window_size tokens in total, and frequency times in all total tokens
+    """
+    observed, frequency = observed.astype(float), frequency.astype(float)
+    expected = window_size * frequency / total
+    # observed and expected counts of the 2x2 table (in window or not) x (this term or another term)
+    cells = [(observed, expected),
+             (window_size - observed, window_size - expected),
+             (frequency - observed, frequency - expected),
+             (total - window_size - frequency + observed, total - window_size - frequency + expected)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pmi = np.log2(observed / expected)
+        g2 = 2 * sum(np.where(o > 0, o * np.log(o / e), 0) for o, e in cells)
+    return expected, pmi, g2
+
+
+def context_windows(doc, start, end, lengths, window):
+    """
+    Get the context windows around the (doc, start, end) spans, with end inclusive and the spans sorted by doc and
+    start, as (doc, start, end) arrays with end exclusive. Overlapping and adjacent windows are merged.
+    :param lengths: The number of tokens of each document
+    """
+    if not len(doc):
+        return doc, start, end
+    start = np.maximum(start - window, 0)
+    end = np.minimum(end + window + 1, lengths[doc])
+    # shift the windows of each document past those of the previous documents, so they can be merged in one pass
+    offset = np.concatenate([[0], np.cumsum(lengths + 1)])[doc]
+    start, end = start + offset, end + offset
+    reach = np.maximum.accumulate(end)
+    first = np.flatnonzero(np.concatenate([[True], start[1:] > reach[:-1]]))
+    offset = offset[first]
+    return doc[first], start[first] - offset, np.maximum.reduceat(end, first) - offset
+
+
+class ContextTokens(object):
+    """
+    Lazy sequence of the context tokens of a number of documents, which can be used as the tokens of a corpus.
+    Item i contains the tokens of the windows of document rows[i], i.e. tokens[rows[i]][start[j]:end[j]] for j in
+    range(ptr[i], ptr[i + 1]). The windows are sliced from the original tokens when an item is accessed.
+    """
+
+    def __init__(self, tokens, rows, ptr, start, end):
+        self.tokens = tokens
+        self.rows = rows
+        self.ptr = ptr
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_spans(cls, tokens, rows, doc, start, end):
+        """Create from the matching rows and the sorted (doc, start, end) windows of those rows"""
+        ptr = np.searchsorted(doc, np.append(rows, np.iinfo(np.int64).max), side="left")
+        return cls(tokens, rows, ptr, start, end)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, Integral):
+            key = range(len(self))[key]
+            doc_tokens = self.tokens[self.rows[key]]
+            return [t for j in range(self.ptr[key], self.ptr[key + 1])
+                    for t in doc_tokens[self.start[j]:self.end[j]]]
+        # a subset of the documents (slice, list of indices or boolean mask), also lazy
+        key = np.arange(len(self))[key]
+        counts = self.ptr[key + 1] - self.ptr[key]
+        ptr = np.concatenate([[0], np.cumsum(counts)])
+        windows = np.repeat(self.ptr[key] - ptr[:-1], counts) + np.arange(ptr[-1])
+        return ContextTokens(self.tokens, self.rows[key], ptr, self.start[windows], self.end[windows])
+
+    def __array__(self, dtype=None):
+        result = np.empty(len(self), dtype=object)
+        for i, doc_tokens in enumerate(self):
+            result[i] = doc_tokens
+        return result
+
+
+def expand_multiterms(q, expand):
+    """
+    Replace prefix and wildcard queries in q by an Or of the matching terms
+    :param expand: function that returns the matching terms for a prefix or wildcard query
+    """
+    if isinstance(q, (wq.Prefix, wq.Wildcard)):
+        terms = expand(q)
+        return wq.Or([wq.Term(q.fieldname, t) for t in terms], boost=q.boost) if terms else wq.NullQuery
+    if q.is_leaf():
+        return q
+    return q.apply(lambda child: expand_multiterms(child, expand))
+
+
+def frequency_matrix(results, n_docs) -> sp.csr_matrix:
+    """
+    Create a (n_docs, n_queries) sparse matrix from a sequence of (rows, frequencies) pairs, one per query
+    """
+    results = list(results)
+    rows = np.concatenate([r for r, _ in results] or [np.empty(0, dtype=np.int64)]).astype(np.int64)
+    cols = np.repeat(np.arange(len(results)), [len(r) for r, _ in results])
+    data = np.concatenate([f for _, f in results] or [np.empty(0)]).astype(float)
+    return sp.csr_matrix((data, (rows, cols)), shape=(n_docs, len(results)))
+
+
+class ResultCache(object):
+    """
+    LRU cache of query results (tuples of arrays) shared by all indices, limited to max_mb of memory
+    """
+
+    def __init__(self, max_mb=256):
+        self.max_mb = max_mb
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value: tuple) -> tuple:
+        for a in value:
+            a.flags.writeable = False  # results are shared, so make sure they are not changed
+        with self._lock:
+            if key in self._entries:
+                self._size -= sum(a.nbytes for a in self._entries.pop(key))
+            self._entries[key] = value
+            self._size += sum(a.nbytes for a in value)
+            while self._size > self.max_mb * 1024 * 1024 and self._entries:
+                _key, old = self._entries.popitem(last=False)
+                self._size -= sum(a.nbytes for a in old)
+        return value
+
+    @property
+    def size_mb(self):
+        return self._size / (1024 * 1024)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+RESULT_CACHE = ResultCache()
+
+
+# result of BaseIndex.preview: a sample of the matching rows and the (estimated, unless exact) number of matches
+Preview = namedtuple("Preview", ["rows", "estimated_total", "exact"])
+# result of BaseIndex.bucket_counts: the start of each time bucket (seconds since the epoch), the (n_buckets, n_queries)
+# array of hit counts and the number of documents in each bucket
+BucketCounts = namedtuple("BucketCounts", ["starts", "counts", "n_docs"])
+
+
+def _apply_mask(mask, rows, *values):
+    """Keep the rows (and corresponding values) for which mask is True, if a mask is given"""
+    if mask is None:
+        return (rows,) + values
+    keep = mask[rows]
+    return (rows[keep],) + tuple(v[keep] for v in values)
+
+
+class SearchCancelled(Exception):
+    """
+    Raised when a search is stopped by the cancellation token of its SearchProgress.
+    results contains the results of the completed queries (and None for the others). search_many sets partial to
+    the hit matrix of the completed queries (with empty columns for the others) and completed to a boolean array
+    telling which queries were completed
+    """
+
+    def __init__(self, results=None):
+        super().__init__("Search cancelled")
+        self.results = results
+        self.partial = None
+        self.completed = None
+
+
+class SearchProgress(object):
+    """
+    Progress reporting and cancellation of a search. Engines call check() regularly (e.g. in matcher loops),
+    which raises SearchCancelled if should_break() returns True, and done() after completing a query.
+    The listeners of the monitor may raise if the search was cancelled (e.g. StopExecution of a widget callback),
+    which is raised as SearchCancelled as well (see notify)
+    """
+
+    def __init__(self, monitor: ProgressMonitor = None, should_break=None, total=0):
+        self.monitor = monitor or NullMonitor()
+        self.should_break = should_break
+        self.total = total
+        self.completed = 0
+
+    def check(self, results=None):
+        if self.should_break is not None and self.should_break():
+            raise SearchCancelled(results)
 
-    def __init__(self, corpus, procs=2, limitmb=256):
-        self.tokens = corpus.tokens
-        self.tempdir = TemporaryDirectory(prefix="orange3sma_index")
-        schema = Schema(text=TEXT(stored=False, analyzer=SpaceSeparatedTokenizer(), phrase=True), doc_i=NUMERIC(int, 64, signed=False, stored=True))
-        self.index = create_in(self.tempdir.name, schema)
-        w = self.index.writer(limitmb=limitmb, procs=procs, multisegment=(procs > 1))
-        for doc_i, doc_tokens in enumerate(self.tokens):
-            w.add_document(text=doc_tokens, doc_i=doc_i)
-        w.commit()
-        
-    def search(self, query: str, frequencies=False):
+    def done(self, n=1, results=None):
+        self.check(results)
+        self.completed += n
+        if n:
+            self.notify(self.monitor.update, n, "Searched {}/{} queries".format(self.completed, self.total),
+                        results=results)
+
+    def notify(self, update, *args, results=None):
+        """
+        Call update(*args), a method of the monitor that notifies its listeners. If a listener raises because
+        the search was cancelled in the meantime, SearchCancelled is raised instead (with results)
+        """
+        try:
+            update(*args)
+        except Exception:
+            self.check(results)
+            raise
+
+
+def _using_index(method):
+    """Decorate a BaseIndex method to mark the index as in use while it runs, see BaseIndex.in_use"""
+    @wraps(method)
+    def wrapper(self, *args, **kargs):
+        with self.in_use():
+            return method(self, *args, **kargs)
+    return wrapper
+
+
+def search_sequentially(queries, search, progress: SearchProgress):
+    """
+    Get search(query) for each query, reporting progress. If the search is cancelled, SearchCancelled.results
+    contains the results of the queries completed so far
+    """
+    results = []
+    try:
+        for query in queries:
+            progress.check()
+            results.append(search(query))
+            progress.done()
+    except SearchCancelled as e:
+        e.results = results + [None] * (len(queries) - len(results))
+        raise
+    return results
+
+
+class BaseIndex(object):
+    """
+    Interface of the index engines (see ENGINES).
+    All engines accept the whoosh query syntax and give the same results.
+    Engines implement schema, _expand_terms, _search_rows and _frequencies_list; results are cached in RESULT_CACHE
+    """
+
+    engine = None
+    # default number of worker processes used by search_many
+    workers = 1
+    # maximum number of compiled queries kept by parse
+    max_compiled_queries = 10000
+    _cache_id = None
+    # where the index is stored ("disk" or "ram") and timing statistics, see latency
+    storage = "ram"
+    build_seconds = None
+    query_count = 0
+    query_seconds = 0.0
+    # how search evaluates which rows match: "bitmap" (boolean operations on compressed bitmaps, see _bitmap)
+    # or "engine" (the query evaluation of the engine)
+    boolean_mode = "bitmap"
+    # maximum number of term bitmaps kept by _bitmap
+    max_cached_bitmaps = 100000
+    # metadata fields that can be used to filter searches, {name: FieldIndex} (see add_fields)
+    fields = {}
+    # set by release, after which the index cannot be searched anymore
+    released = False
+    # incremented when documents are added (see Index.append), which makes the views on the index stale
+    generation = 0
+    # number of searches (or other operations) running on the index, which is not released while they run
+    _use_count = 0
+    # count simple dictionaries (terms and phrases with weights, see dictionary_matcher) by scanning the tokens,
+    # if there are at least this number of queries or the tokens are already interned (see forward_index)
+    min_dictionary_size = 100
+
+    @property
+    def cache_id(self):
+        """Identifies the current content of the index in the result cache (reset if documents are added)"""
+        if self._cache_id is None:
+            self._cache_id = uuid4().hex
+        return self._cache_id
+
+    @property
+    def schema(self):
+        """The whoosh schema used to parse queries"""
+        raise NotImplementedError()
+
+    def _expand_terms(self, q) -> list:
+        """Get the terms in the index matching a prefix or wildcard query"""
+        raise NotImplementedError()
+
+    def require_positions(self, query: str = None):
+        """
+        Make sure the index can answer the query (or get_context, if query is None).
+        Only compact whoosh indexes have to be upgraded for this, see Index.require_positions
+        """
+
+    def parse(self, query: str):
+        """
+        Parse the query string into a whoosh query object, with prefixes and wildcards expanded to the matching terms.
+        Compiled queries are cached (see query_cache_info)
+        """
+        self._check_released()
+        if getattr(self, "_compiled_id", None) != self.cache_id:
+            # the index changed, so the expansions may have changed as well
+            self._compiled = OrderedDict()
+            self._compiled_id = self.cache_id
+            self._compiled_lock = Lock()
+            self._compiled_hits = self._compiled_misses = 0
+            self._parser = QueryParser("text", self.schema)
+        with self._compiled_lock:
+            q = self._compiled.get(query)
+            if q is not None:
+                self._compiled_hits += 1
+                self._compiled.move_to_end(query)
+                return q
+            self._compiled_misses += 1
+            q = expand_multiterms(self._parser.parse(query), self._expand_terms)
+            self._compiled[query] = q
+            if len(self._compiled) > self.max_compiled_queries:
+                self._compiled.popitem(last=False)
+            return q
+
+    def query_cache_info(self) -> dict:
+        """Get the hits, misses and size of the compiled query cache"""
+        return dict(hits=getattr(self, "_compiled_hits", 0), misses=getattr(self, "_compiled_misses", 0),
+                    size=len(getattr(self, "_compiled", ())), maxsize=self.max_compiled_queries)
+
+    @property
+    def n_docs(self):
+        return len(self.tokens)
+
+    @property
+    def doc_lengths(self) -> np.ndarray:
+        """The number of tokens of each document"""
+        cached = getattr(self, "_doc_lengths", None)
+        if cached is None or cached[0] is not self.tokens:
+            lengths = np.fromiter(map(len, self.tokens), dtype=np.int64, count=self.n_docs)
+            cached = self._doc_lengths = (self.tokens, lengths)
+        return cached[1]
+
+    def _search_rows(self, query: str) -> np.ndarray:
+        """Get the sorted array of corpus rows matching the query"""
+        raise NotImplementedError()
+
+    def _frequencies_list(self, queries, workers=1, progress: SearchProgress = None):
+        """
+        Get a (rows, frequencies) pair of arrays for each query, reporting progress and checking for
+        cancellation with progress (see search_sequentially)
+        """
+        raise NotImplementedError()
+
+    def _leaf_evaluator(self, q):
+        """
+        Context manager giving a function that returns the sorted array of rows matching a leaf query
+        (or another query that _bitmap cannot evaluate) of the parsed query q
+        """
+        raise NotImplementedError()
+
+    def _evaluate(self, query: str, progress: SearchProgress = None) -> np.ndarray:
+        """Get the sorted array of corpus rows matching the query, using the boolean_mode"""
+        progress = progress or SearchProgress()
+        progress.check()
+        if self.boolean_mode != "bitmap":
+            return self._search_rows(query)
+        q = self.parse(query)
+        with self._leaf_evaluator(q) as leaf_rows:
+            def checked_leaf_rows(leaf):
+                progress.check()
+                return leaf_rows(leaf)
+            return self._bitmap(q, checked_leaf_rows).to_array()
+
+    def _term_bitmap(self, q, leaf_rows) -> Bitmap:
+        if getattr(self, "_bitmaps_id", None) != self.cache_id:
+            self._bitmaps = OrderedDict()
+            self._bitmaps_id = self.cache_id
+        bitmap = self._bitmaps.get(q.text)
+        if bitmap is None:
+            bitmap = self._bitmaps[q.text] = Bitmap.from_array(leaf_rows(q))
+            if len(self._bitmaps) > self.max_cached_bitmaps:
+                self._bitmaps.popitem(last=False)
+        else:
+            self._bitmaps.move_to_end(q.text)
+        return bitmap
+
+    def _bitmap(self, q, leaf_rows) -> Bitmap:
+        """
+        Evaluate the parsed query as operations on the (cached) bitmaps of the terms. Other leaves (e.g. phrases)
+        are evaluated by leaf_rows
+        """
+        if isinstance(q, wq.Term):
+            return self._term_bitmap(q, leaf_rows)
+        if isinstance(q, wq.And):
+            positive = [self._bitmap(s, leaf_rows) for s in q.subqueries if not isinstance(s, wq.Not)]
+            result = None
+            for bitmap in sorted(positive, key=len):  # intersect the smallest bitmaps first
+                result = bitmap if result is None else result & bitmap
+            if result is None:
+                result = Bitmap.full(self.n_docs)
+            negative = [self._bitmap(s.query, leaf_rows) for s in q.subqueries if isinstance(s, wq.Not)]
+            return result - Bitmap.union(negative) if negative else result
+        if isinstance(q, wq.Or):
+            return Bitmap.union(self._bitmap(s, leaf_rows) for s in q.subqueries)
+        if isinstance(q, wq.Not):
+            return Bitmap.full(self.n_docs) - self._bitmap(q.query, leaf_rows)
+        if isinstance(q, wq.AndNot):
+            return self._bitmap(q.a, leaf_rows) - self._bitmap(q.b, leaf_rows)
+        if isinstance(q, wq.AndMaybe):
+            return self._bitmap(q.a, leaf_rows)
+        if q is wq.NullQuery or isinstance(q, type(wq.NullQuery)):
+            return Bitmap()
+        return Bitmap.from_array(leaf_rows(q))
+
+    def _result_key(self, query: str, frequencies: bool):
+        parts = divide_query(query) if frequencies else [query]
+        return self.cache_id, frequencies, tuple(repr(self.parse(q).normalize()) for q in parts)
+
+    def _record_query_time(self, start, n_queries=1):
+        self.query_count += n_queries
+        self.query_seconds += time.perf_counter() - start
+        get_index_registry().touch(self)
+
+    def latency(self) -> dict:
+        """
+        Get the storage mode, the time it took to build (or open) the index, and the number and average duration
+        of the queries searched so far (including queries answered from the result cache)
+        """
+        return dict(engine=self.engine, storage=self.storage, build_seconds=self.build_seconds,
+                    queries=self.query_count,
+                    mean_query_seconds=self.query_seconds / self.query_count if self.query_count else None)
+
+    def _interned(self):
+        """The forward_index, if it was already computed, otherwise None"""
+        cached = getattr(self, "_forward_index", None)
+        return cached[1] if cached is not None and cached[0] is self.tokens else None
+
+    def _dictionary_scan_mb(self) -> float:
+        """Estimate the memory (in MB) used by dictionary_frequencies, which scans the tokens in chunks"""
+        return SCAN_BYTES_PER_TOKEN * min(int(self.doc_lengths.sum()), CHUNK_TOKENS) / 1024 / 1024
+
+    def _simple_dictionary(self, queries):
+        """Get the parsed queries if they can be counted with dictionary_frequencies, otherwise None"""
+        if self.min_dictionary_size is None or self.tokens is None:
+            return None
+        if len(queries) < self.min_dictionary_size and self._interned() is None:
+            return None
+        patterns = [parse_simple_query(q) for q in queries]
+        if None in patterns:
+            return None
+        # the scan is reserved in the index registry, like the write buffers of indexing processes
+        registry = get_index_registry()
+        if registry.max_ram_mb is not None and \
+                self._dictionary_scan_mb() > registry.max_ram_mb * registry.max_reserved_fraction:
+            return None
+        return patterns
+
+    def _dictionary_frequencies(self, patterns, progress: SearchProgress):
+        with get_index_registry().reserve(self._dictionary_scan_mb()):
+            results = dictionary_frequencies(patterns, self.tokens, self._interned(), check=progress.check)
+        progress.done(len(patterns), results)
+        return results
+
+    def _cached_frequencies(self, queries, workers=None, progress: SearchProgress = None):
+        progress = progress or SearchProgress()
+        self._check_released()
+        patterns = self._simple_dictionary(queries)
+        if patterns is not None:
+            # simple queries are not parsed by whoosh, so they are cached by their text
+            keys = [(self.cache_id, True, ("dictionary", q)) for q in queries]
+        else:
+            keys = [self._result_key(q, True) for q in queries]
+        results = [RESULT_CACHE.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        # a search cancelled before computing any query still has the cached results
+        progress.done(len(queries) - len(missing), results)
+        if missing:
+            workers = self.workers if workers is None else workers
+            cancelled = None
+            try:
+                if patterns is not None:
+                    computed = self._dictionary_frequencies([patterns[i] for i in missing], progress)
+                else:
+                    computed = self._frequencies_list([queries[i] for i in missing], workers=workers,
+                                                      progress=progress)
+            except SearchCancelled as e:
+                cancelled, computed = e, e.results or [None] * len(missing)
+            # also cache the results of a cancelled search, so searching again continues where it stopped
+            for i, result in zip(missing, computed):
+                if result is not None:
+                    results[i] = RESULT_CACHE.put(keys[i], tuple(result))
+            if cancelled is not None:
+                cancelled.results = results
+                raise cancelled
+        return results
+
+    @_using_index
+    def search(self, query: str, frequencies=False, filters=None):
         """
         Get the indices of the documents matching the query
         :param query: The whoosh query string
         :param frequencies: If true, return pairs of (docnum, frequency) rather than only docnum
+        :param filters: only return documents matching these field filters, see add_fields
         :return: sequence of document numbers (and freqs, if frequencies is True)
         """
+        start = time.perf_counter()
+        mask = self._filter_mask(filters)
+        if frequencies:
+            rows, freqs = _apply_mask(mask, *self._cached_frequencies([query])[0])
+            result = list(zip(rows.tolist(), freqs.tolist()))
+        else:
+            result = _apply_mask(mask, self._cached_rows(query))[0].tolist()
+        self._record_query_time(start)
+        return result
 
-        with self.index.searcher(weighting=scoring.Frequency) as searcher:
-            if frequencies:
-                ## for some reason, using searcher.search counts all individual occurrences of the terms in a phrase ("term1 term2")
-                ## after the phrase occurs at least once. So for frequencies, we use this lengthy alternative
-                ## (I expect that somewhere a setting is hidden to simply fix this with searcher.search, but no clue yet)
-                results = defaultdict(lambda:float(0))
-                queries = divide_query(query)
-
-                for i, q in enumerate(queries):
-                    q = QueryParser("text", self.index.schema).parse(q)
-                    matcher = q.matcher(searcher)
-
-                    while matcher.is_active():
-                        docnum = searcher.reader().stored_fields(matcher.id())['doc_i']
-                        bd = boostdict(matcher)
-                        for s in matcher.spans():
-                            results[docnum] += bd[s] if s in bd else 1
-                        matcher.next()
-                return [(k,v) for k,v in results.items()]
-            else:
-                query = QueryParser("text", self.index.schema).parse(query)
-                results = searcher.search(query, limit=None, scored=False, sortedby=None)
-                return [results[i]['doc_i'] for i in range(len(results))]
+    def _cached_rows(self, query: str, progress: SearchProgress = None) -> np.ndarray:
+        key = self._result_key(query, False)
+        rows = RESULT_CACHE.get(key)
+        if rows is None:
+            rows = RESULT_CACHE.put(key, (self._evaluate(query, progress),))
+        return rows[0]
+
+    @_using_index
+    def search_rows(self, query: str, should_break=None, filters=None) -> np.ndarray:
+        """
+        Get the sorted array of the rows matching the query. Without filters, the array is shared with the
+        result cache, so it is read-only
+        :param should_break: cancellation token: a function that returns True if the search should be stopped,
+                             in which case SearchCancelled is raised
+        :param filters: only return documents matching these field filters, see add_fields
+        """
+        start = time.perf_counter()
+        mask = self._filter_mask(filters)
+        rows = _apply_mask(mask, self._cached_rows(query, SearchProgress(should_break=should_break)))[0]
+        self._record_query_time(start)
+        return rows
+
+    @_using_index
+    def preview(self, query: str, k=100, time_budget=None, filters=None) -> Preview:
+        """
+        Get (at most) the first k rows matching the query without necessarily evaluating the whole query,
+        e.g. to see whether a query matches at all before doing a full search
+        :param k: stop after k matching rows
+        :param time_budget: stop after this number of seconds (if given)
+        :param filters: only return documents matching these field filters, see add_fields
+        :return: a Preview with the sorted rows and the total number of matching rows, estimated from the fraction
+                 of the index that was searched unless exact is True
+        """
+        start = time.perf_counter()
+        mask = self._filter_mask(filters)
+        cached = RESULT_CACHE.get(self._result_key(query, False))
+        if cached is not None:
+            rows = _apply_mask(mask, cached[0])[0]
+            result = Preview(rows[:k], len(rows), True)
+        else:
+            result = self._preview(query, k, None if time_budget is None else start + time_budget, mask)
+        self._record_query_time(start)
+        return result
+
+    def _preview(self, query: str, k, deadline, mask=None) -> Preview:
+        """
+        Get the preview of the rows in mask (if given), stopping at the deadline (perf_counter time).
+        Engines that can stop early override this
+        """
+        rows = _apply_mask(mask, self._cached_rows(query))[0]
+        return Preview(rows[:k], len(rows), True)
+
+    @_using_index
+    def search_many(self, queries, workers=None, monitor: ProgressMonitor = None, should_break=None,
+                    filters=None) -> sp.csr_matrix:
+        """
+        Get the (weighted) frequencies of multiple queries at once
+        :param queries: sequence of whoosh query strings
+        :param workers: number of worker processes to divide the queries over (default: self.workers).
+                        Engines that cannot share their index with other processes ignore this
+        :param monitor: ProgressMonitor to report the progress (in queries) to
+        :param should_break: cancellation token: a function that returns True if the search should be stopped.
+                             SearchCancelled is then raised, with the hit matrix of the completed queries as partial
+        :param filters: only count documents matching these field filters, see add_fields
+        :return: sparse matrix of shape (n_documents, n_queries). Matching documents are stored entries,
+                 even if their frequency is zero
+        """
+        start = time.perf_counter()
+        queries = list(queries)
+        mask = self._filter_mask(filters)
+        progress = SearchProgress(monitor, should_break, total=len(queries))
+        # begin rather than task, as done would notify the listeners (that may raise) when the search is cancelled
+        progress.monitor.begin(len(queries), "Searching {} queries".format(len(queries)))
+        try:
+            results = self._cached_frequencies(queries, workers, progress)
+            result = frequency_matrix((_apply_mask(mask, *r) for r in results), self.n_docs)
+            progress.notify(progress.monitor.done, results=results)
+        except SearchCancelled as e:
+            e.completed = np.array([r is not None for r in e.results], dtype=bool)
+            empty = (np.empty(0, dtype=np.int64), np.empty(0))
+            e.partial = frequency_matrix([empty if r is None else _apply_mask(mask, *r) for r in e.results],
+                                         self.n_docs)
+            raise
+        finally:
+            self._record_query_time(start, len(queries))
+        return result
+
+    def bucket_counts(self, queries, field: str, interval="week", filters=None, **kargs) -> BucketCounts:
+        """
+        Get the hit counts of the queries aggregated into time buckets of a date field, e.g. to plot query trends
+        :param field: name of the date field (see add_fields) to divide the documents in time buckets
+        :param interval: "day", "week", "month" or "year"
+        :param kargs: workers, monitor and should_break, see search_many
+        """
+        matrix = self.search_many(queries, filters=filters, **kargs)
+        return self.aggregate_buckets(matrix, field, interval, filters)
 
-    def get_context(self, query: str, window: int = 30):
+    @_using_index
+    def aggregate_buckets(self, matrix, field: str, interval="week", filters=None) -> BucketCounts:
+        """
+        Aggregate a (n_docs, n_queries) hit matrix (see search_many) into time buckets of a date field.
+        The documents are summed per bucket with a single sparse product of a (n_buckets, n_docs) indicator matrix,
+        built from the (cached) bucket of each document
+        """
+        if field not in self.fields:
+            raise ValueError("Field {!r} is not indexed, use get_index(..., fields=[{!r}])".format(field, field))
+        codes, starts = self.fields[field].buckets(interval)
+        docs = np.flatnonzero(codes >= 0)
+        mask = self._filter_mask(filters)
+        if mask is not None:
+            docs = docs[mask[docs]]
+        indicator = sp.csr_matrix((np.ones(len(docs)), (codes[docs], docs)), shape=(len(starts), self.n_docs))
+        counts = np.asarray((indicator @ sp.csr_matrix(matrix)).todense())
+        return BucketCounts(starts, counts, np.bincount(codes[docs], minlength=len(starts)))
+
+    def _match_spans(self, query: str):
+        """
+        Get the sorted array of rows matching the query, and the (row, start, end) arrays of the matching
+        spans (with end inclusive), sorted by row and start
+        """
+        raise NotImplementedError()
+
+    def _filtered_spans(self, query: str, filters):
+        rows, (doc, start, end) = self._match_spans(query)
+        mask = self._filter_mask(filters)
+        return _apply_mask(mask, rows)[0], _apply_mask(mask, doc, start, end)
+
+    def _context(self, query: str, window: int, filters=None):
+        rows, (doc, start, end) = self._filtered_spans(query, filters)
+        return rows, context_windows(doc, start, end, self.doc_lengths, window)
+
+    @_using_index
+    def get_context_spans(self, query: str, window: int = 30, filters=None):
+        """
+        Get the context (n-word window) of all locations of the query as token offsets, without copying any tokens
+
+        :param query: search query
+        :param window: window size (in words)
+        :param filters: only return the context in documents matching these field filters, see add_fields
+        :return: (doc, start, end) arrays, sorted by doc and start: the contexts are tokens[doc][start:end].
+                 Overlapping windows are merged
+        """
+        return self._context(query, window, filters)[1]
+
+    @_using_index
+    def context_tokens(self, query: str, window: int = 30, filters=None) -> ContextTokens:
+        """
+        Get the context (n-word window) of all locations of the query as a lazy sequence of tokens per matching
+        document (see ContextTokens), which can be used as the tokens of corpus[result.rows]
+        """
+        rows, (doc, start, end) = self._context(query, window, filters)
+        return ContextTokens.from_spans(self.tokens, rows, doc, start, end)
+
+    def add_fields(self, fields: dict):
+        """
+        Add (or replace) metadata fields that can be used in the filters argument of the search methods.
+        See orangecontrib.sma.fields for the available filters
+        :param fields: dict of {name: FieldIndex} with values for each document, e.g. from fields.corpus_fields
+        """
+        for name, field in fields.items():
+            if len(field) != self.n_docs:
+                raise ValueError("Field {!r} has {} values for {} documents".format(name, len(field), self.n_docs))
+        self.fields = dict(self.fields, **fields)
+
+    def _filter_mask(self, filters):
+        return filter_mask(self.fields, filters, self.n_docs)
+
+    @property
+    def forward_index(self):
+        """The interned tokens as (terms, token_ids, doc_ptr) arrays, see intern_tokens"""
+        cached = getattr(self, "_forward_index", None)
+        if cached is None or cached[0] is not self.tokens:
+            cached = self._forward_index = (self.tokens, intern_tokens(self.tokens))
+        return cached[1]
+
+    @_using_index
+    def collocations(self, query: str, window: int = 5, filters=None):
+        """
+        Count the terms occurring within window tokens of the matches of the query, without building token lists.
+        Tokens in the windows of more than one match are counted once, the matches themselves are not counted.
+
+        :return: (terms, scores) with scores an OrderedDict of arrays aligned with terms: window_count, frequency
+                 (in the whole index), expected (window count if the terms were distributed randomly),
+                 pmi (pointwise mutual information, in bits) and log_likelihood (G2). Only terms with a
+                 window_count are included
+        """
+        terms, token_ids, doc_ptr = self.forward_index
+        _rows, (doc, start, end) = self._filtered_spans(query, filters)
+        in_window = np.zeros(len(token_ids), dtype=bool)
+        w_doc, w_start, w_end = context_windows(doc, start, end, self.doc_lengths, window)
+        in_window[expand_ranges(doc_ptr[w_doc] + w_start, doc_ptr[w_doc] + w_end)] = True
+        in_window[expand_ranges(doc_ptr[doc] + start, doc_ptr[doc] + end + 1)] = False
+        counts = np.bincount(token_ids[in_window], minlength=len(terms))
+        frequency = np.bincount(token_ids, minlength=len(terms))
+        expected, pmi, g2 = association_scores(counts, int(in_window.sum()), frequency, len(token_ids))
+        found = np.flatnonzero(counts)
+        return terms[found], OrderedDict([("window_count", counts[found]),
+                                          ("frequency", frequency[found]),
+                                          ("expected", expected[found]),
+                                          ("pmi", pmi[found]),
+                                          ("log_likelihood", g2[found])])
+
+    def get_context(self, query: str, window: int = 30, filters=None):
         """
         Get the words in the context (n-word window) of all locations of the string
 
         :param query: search query
         :param window: window size (in words)
+        :param filters: only return the context in documents matching these field filters, see add_fields
         :return: a generator of (id, text) pairs
         """
-        def get_window_tokens(tokens, spans):
-            position = -1
-            for span in spans:
-                for position in range(max(position + 1, span.start - window), min(len(tokens), span.end + window + 1)):
-                    yield tokens[position]
+        context = self.context_tokens(query, window, filters)
+        yield from zip(context.rows.tolist(), context)
 
-        query = QueryParser("text", self.index.schema).parse(query)
-        with self.index.searcher() as searcher:
-            matcher = query.matcher(searcher)
-            while matcher.is_active():
-                docnum = searcher.reader().stored_fields(matcher.id())['doc_i']
-                yield docnum, list(get_window_tokens(self.tokens[docnum], matcher.spans()))
-                matcher.next()
+    def _term_arrays(self):
+        """Compute the (terms, docfreq, termfreq) arrays, see term_arrays"""
+        terms, token_ids, doc_ptr = self.forward_index
+        return (terms,) + term_counts(terms, token_ids, doc_ptr)
+
+    @_using_index
+    def term_arrays(self):
+        """
+        Get the terms in the index with their document and collection (total) frequencies
+        :return: (terms, docfreq, termfreq) aligned arrays, sorted by term. The arrays are cached (and read-only)
+        """
+        self._check_released()
+        cached = getattr(self, "_term_arrays_cache", None)
+        if cached is None or cached[0] != self.cache_id:
+            arrays = self._term_arrays()
+            for a in arrays:
+                a.flags.writeable = False
+            cached = self._term_arrays_cache = (self.cache_id, arrays)
+        return cached[1]
 
     def term_statistics(self):
         """
         Yield the term and document frequency for each term in the index
-        :return: generator of (term, termfreq, docfreq) triples
+        :return: generator of (term, docfreq, termfreq) triples
+        """
+        terms, docfreq, termfreq = self.term_arrays()
+        yield from zip(terms.tolist(), docfreq.tolist(), termfreq.tolist())
+
+    def memory_usage(self) -> int:
+        """
+        Estimate the memory (in bytes) used by the arrays of the index and its caches, excluding the corpus tokens
+        and the shared result cache (see IndexRegistry)
+        """
+        return sum(_nbytes(value, self.tokens) for name, value in vars(self).items() if name != "tokens")
+
+    def disk_usage(self) -> int:
+        """Get the size (in bytes) of the temporary files of the index (see IndexRegistry)"""
+        tempdir = getattr(self, "tempdir", None)
+        return _directory_size(tempdir.name) if tempdir is not None else 0
+
+    @contextmanager
+    def in_use(self):
+        """
+        Mark the index as in use while in this context (e.g. during a search or while adding documents),
+        so it is not released in the meantime. Raises ValueError if the index was already released
+        """
+        with _USE_LOCK:
+            self._check_released()
+            self._use_count += 1
+        try:
+            yield self
+        finally:
+            with _USE_LOCK:
+                self._use_count -= 1
+
+    @property
+    def busy(self) -> bool:
+        """Is the index in use, see in_use?"""
+        return self._use_count > 0
+
+    def release(self):
+        """
+        Free the memory and temporary files of the index, after which it can no longer be searched.
+        Used by IndexRegistry to stay within its budgets; get_index recreates released indexes.
+        An index that is in use (see in_use) is not released
+        """
+        with _USE_LOCK:
+            if self.released or self._use_count:
+                return
+            self.released = True
+        self._free()
+
+    def _free(self):
+        """Free the memory and temporary files of a released index. Engines extend this for their own data"""
+        for name in ("_bitmaps", "_compiled", "_forward_index", "_term_arrays_cache", "_doc_lengths"):
+            self.__dict__.pop(name, None)
+        self.fields = {}
+        tempdir = getattr(self, "tempdir", None)
+        if tempdir is not None:
+            self.tempdir = None
+            try:
+                tempdir.cleanup()
+            except OSError:
+                log.warning("Could not remove temporary index directory {}".format(tempdir.name))
+
+    def _check_released(self):
+        if self.released:
+            raise ValueError("The index was released to stay within the index budget (see IndexRegistry), "
+                             "use get_index to recreate it")
+
+    def subset(self, rows, tokens) -> 'BaseIndex':
         """
+        Get a view on this index for a subset of the documents, e.g. for corpus[rows]
+        :param rows: the rows of this index that are in the subset, in the order of the subset
+        :param tokens: the tokens of the subset corpus
+        :return: an IndexView, or None if rows contains duplicates
+        """
+        return IndexView.create(self, rows, tokens)
+
+
+class IndexView(BaseIndex):
+    """
+    Index of a subset of the documents of a parent index. Searches are done on the parent index (sharing
+    its result cache) and the results are restricted to the subset and renumbered to its rows
+    """
+
+    def __init__(self, parent: BaseIndex, rows: np.ndarray, tokens):
+        self.parent = parent
+        self.rows = rows
+        self.tokens = tokens
+        self.engine = parent.engine
+        self.storage = parent.storage
+        self.workers = parent.workers
+        # parent row -> row in this view, or -1 if the document is not in the subset
+        self.remap = np.full(parent.n_docs, -1, dtype=np.int64)
+        self.remap[rows] = np.arange(len(rows))
+        self._fields = {}
+        self._parent_generation = parent.generation
+
+    @property
+    def released(self):
+        return self.parent.released
+
+    @property
+    def stale(self) -> bool:
+        """Were documents added to the parent index after the view was created? Then remap is outdated"""
+        return self._parent_generation != self.parent.generation
+
+    def in_use(self):
+        if self.stale:
+            raise ValueError("Documents were added to the parent index of this view, use get_index to recreate it")
+        return self.parent.in_use()
+
+    @property
+    def busy(self) -> bool:
+        return self.parent.busy
+
+    @property
+    def fields(self):
+        fields = {name: field.subset(self.rows) for name, field in self.parent.fields.items()}
+        fields.update(self._fields)
+        return fields
+
+    def add_fields(self, fields: dict):
+        for name, field in fields.items():
+            if len(field) != self.n_docs:
+                raise ValueError("Field {!r} has {} values for {} documents".format(name, len(field), self.n_docs))
+        self._fields = dict(self._fields, **fields)
+
+    @classmethod
+    def create(cls, parent: BaseIndex, rows, tokens):
+        rows = np.arange(parent.n_docs)[rows]  # also handles slices and boolean masks
+        if len(np.unique(rows)) != len(rows):
+            return None
+        if isinstance(parent, IndexView):
+            return cls(parent.parent, parent.rows[rows], tokens)
+        return cls(parent, rows, tokens)
+
+    @property
+    def schema(self):
+        return self.parent.schema
+
+    def parse(self, query: str):
+        return self.parent.parse(query)
+
+    def require_positions(self, query: str = None):
+        self.parent.require_positions(query)
+
+    def _restrict(self, rows, *values):
+        new_rows = self.remap[rows]
+        keep = new_rows >= 0
+        return (new_rows[keep],) + tuple(v[keep] for v in values)
+
+    def _search_rows(self, query: str) -> np.ndarray:
+        return np.sort(self._restrict(self.parent._cached_rows(query))[0])
+
+    def _evaluate(self, query: str, progress: SearchProgress = None) -> np.ndarray:
+        return np.sort(self._restrict(self.parent._cached_rows(query, progress))[0])
+
+    def _frequencies_list(self, queries, workers=1, progress: SearchProgress = None):
+        try:
+            results = self.parent._cached_frequencies(queries, workers, progress)
+        except SearchCancelled as e:
+            e.results = [None if r is None else self._restrict(*r) for r in e.results]
+            raise
+        return [self._restrict(rows, freqs) for rows, freqs in results]
+
+    def _match_spans(self, query: str):
+        rows, (doc, start, end) = self.parent._match_spans(query)
+        doc, start, end = self._restrict(doc, start, end)
+        order = np.lexsort((start, doc))
+        return np.sort(self._restrict(rows)[0]), (doc[order], start[order], end[order])
+
+
+
+class Index(BaseIndex):
+    """Wrapper around a whoosh index"""
+
+    engine = "whoosh"
+    # minimum number of documents per process when indexing in parallel
+    min_chunk_size = 5000
+
+    def __init__(self, corpus, procs=2, limitmb=256, directory=None, monitor: ProgressMonitor = None, storage="disk",
+                 positions=True):
+        """
+        :param corpus: The corpus (or other object with tokens) to index. Can be None to open an existing index
+                       without its tokens (e.g. in a worker process), in which case get_context cannot be used
+        :param procs: Number of processes to index with. Each process indexes a contiguous chunk of the documents
+                      into its own segment
+        :param directory: If given, store the index in this directory (and reopen it if it already
+                          contains an index). Otherwise, the index is stored in a temporary directory.
+        :param monitor: ProgressMonitor to report the indexing progress (in documents) to
+        :param storage: "disk" or "ram". A RAM index (whoosh RamStorage) is not stored in a directory, so it is
+                        built with a single process and cannot be searched by worker processes
+        :param positions: If False, create a compact index without term positions. It is upgraded to a positional
+                          index (once) when a phrase query or get_context needs positions, see require_positions
+        """
+        start = time.perf_counter()
+        self.tokens = corpus.tokens if corpus is not None else None
+        self.storage = storage
+        self._build_args = dict(procs=procs, limitmb=limitmb)
+        self._upgrade_lock = Lock()
+        self._docmaps = {}
+        if storage == "ram":
+            self.directory = None
+            self.index = RamStorage().create_index(index_schema(positions))
+            procs = 1
+        else:
+            if directory is None:
+                self.tempdir = TemporaryDirectory(prefix="orange3sma_index")
+                directory = self.tempdir.name
+            self.directory = directory
+            if exists_in(directory):
+                self.index = open_dir(directory)
+                self.build_seconds = time.perf_counter() - start
+                return
+            self.index = create_in(directory, index_schema(positions))
+        monitor = monitor or NullMonitor()
+        n = len(self.tokens)
+        procs = min(procs, n // self.min_chunk_size)
+        # each indexing process can use limitmb for its write buffers
+        with get_index_registry().reserve(max(procs, 1) * limitmb), monitor.task(n, "Indexing {} documents".format(n)):
+            if procs > 1:
+                self._build_parallel(procs, limitmb, monitor)
+            else:
+                w = self.index.writer(limitmb=limitmb)
+                for doc_i, doc_tokens in enumerate(self.tokens):
+                    w.add_document(text=doc_tokens, doc_i=doc_i)
+                    if doc_i % 1000 == 999:
+                        monitor.update(1000, "Indexing document {}/{}".format(doc_i + 1, n))
+                w.commit()
+        self._commit_docmap()
+        self.build_seconds = time.perf_counter() - start
+        log.info("Indexed {} documents in {} storage ({}) in {:.2f}s".format(
+            n, storage, "positional" if positions else "compact", self.build_seconds))
+
+    @property
+    def positions(self) -> bool:
+        """Does the index store term positions (needed for phrase queries and get_context)?"""
+        return self.index.schema["text"].format.supports("positions")
+
+    def require_positions(self, query: str = None):
+        """
+        Make sure the index can answer the query (or get_context, if query is None).
+        If this needs positions and the index is compact, it is reindexed with positions into a new
+        temporary directory (or RAM storage), which is then used from now on
+        """
+        if self.positions or (query is not None and not uses_positions(self.parse(query))):
+            return
+        # the index is in use while it is upgraded, so it is not released
+        with self.in_use(), self._upgrade_lock:
+            if self.positions:
+                return
+            if self.tokens is None:
+                raise ValueError("Cannot add positions to an index opened without its tokens")
+            self.wait_for_merge()
+            # build the positional index from our own tokens, and only switch to it when it is complete
+            upgraded = Index(self, storage=self.storage, **self._build_args)
+            self.tempdir = getattr(upgraded, "tempdir", None)
+            self.directory = upgraded.directory
+            self._docmaps = upgraded._docmaps
+            self.index = upgraded.index
+            # results computed from the compact index are not reused for the positional index
+            self._cache_id = None
+            log.info("Added positions to the index in {:.2f}s".format(upgraded.build_seconds))
+
+    def _build_parallel(self, procs, limitmb, monitor):
+        """
+        Index contiguous chunks of the documents in separate processes, each creating its own segment,
+        and commit all segments at once
+        """
+        n = len(self.tokens)
+        bounds = [round(i * n / procs) for i in range(procs + 1)]
+        segments = [None] * procs
+        w = SegmentWriter(self.index)  # locks the index while the chunks are being indexed
+        try:
+            with ProcessPoolExecutor(max_workers=procs) as pool:
+                futures = {pool.submit(_index_chunk, self.directory, start, list(self.tokens[start:end]), limitmb): i
+                           for i, (start, end) in enumerate(zip(bounds, bounds[1:]))}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    i = futures[future]
+                    segments[i] = future.result()
+                    monitor.update(bounds[i + 1] - bounds[i], "Indexed chunk {}/{}".format(done, procs))
+        except BaseException:
+            w.cancel()
+            raise
+        w._close_segment()
+        w._commit_toc(segments)
+        w._finish()
+
+    def append(self, corpus, limitmb=256, merge=True):
+        """
+        Add the documents that were appended to the corpus since it was indexed.
+        The new documents are written as a separate segment, which is merged with the existing segments
+        in a background thread (unless merge is False).
+        The documents already in the index should be identical to the first documents of the corpus.
+        """
+        self.wait_for_merge()
+        tokens = corpus.tokens
+        with self.in_use(), get_index_registry().reserve(limitmb):
+            w = self.index.writer(limitmb=limitmb)
+            for doc_i in range(self.index.doc_count_all(), len(tokens)):
+                w.add_document(text=tokens[doc_i], doc_i=doc_i)
+            w.commit(merge=False)
+        self._commit_docmap()
+        self.tokens = tokens
+        self._cache_id = None
+        self.generation += 1
+        if merge:
+            self.merge_segments()
+
+    def merge_segments(self, background=True):
+        """
+        Merge small segments (e.g. created by append) into larger segments
+        """
+        def merge():
+            self.index.writer(timeout=60).commit()
+            self._commit_docmap()
+        if background:
+            self._merge_thread = Thread(target=merge, daemon=True)
+            self._merge_thread.start()
+        else:
+            merge()
+
+    def wait_for_merge(self):
+        """Wait until a background merge (if any) is finished"""
+        thread = getattr(self, "_merge_thread", None)
+        if thread is not None:
+            thread.join()
+            self._merge_thread = None
+
+    def docmap(self, reader) -> np.ndarray:
+        """
+        Get the array that maps the document numbers of the (whoosh) reader to corpus rows (doc_i).
+        Document numbers change when segments are merged, so the mapping is stored per index generation
+        """
+        generation = reader.generation()
+        docmap = self._docmaps.get(generation)
+        if docmap is None:
+            path = self.directory and os.path.join(self.directory, "doc_i_{}.npy".format(generation))
+            if path and os.path.exists(path):
+                docmap = np.load(path, mmap_mode="r")
+            else:
+                docmap = np.fromiter((fields['doc_i'] for fields in reader.all_stored_fields()),
+                                     dtype=np.int64, count=reader.doc_count_all())
+            if path and not os.path.exists(path):
+                tmp = "{}.{}.tmp.npy".format(path[:-4], uuid4().hex)
+                np.save(tmp, docmap)
+                os.replace(tmp, path)
+            self._docmaps = {generation: docmap}
+        return docmap
+
+    def _commit_docmap(self):
+        """Create the docmap of the latest generation and remove those of older generations"""
+        with self.index.reader() as reader:
+            self.docmap(reader)
+            current = "doc_i_{}.npy".format(reader.generation())
+        if self.directory is None:
+            # RAM index: only the docmap of the current generation is needed
+            self._docmaps = {k: v for k, v in self._docmaps.items() if k == reader.generation()}
+            return
+        for f in os.listdir(self.directory):
+            if re.match(r"doc_i_\d+\.npy$", f) and f != current:
+                try:
+                    os.remove(os.path.join(self.directory, f))
+                except OSError:
+                    pass
+
+    def _frequencies(self, searcher, query: str, progress: SearchProgress = None):
+        """
+        Get the corpus rows matching the query and their (weighted) frequencies as a pair of arrays.
+        The frequency is the number of spans of the positive leaves of the query (see _positive_leaves),
+        where identical spans are counted once with the boost of the last leaf. Negated clauses only
+        exclude documents, and count nothing
+        """
+        if not self.positions:
+            return self._compact_frequencies(searcher, query)
+        n = searcher.doc_count_all()
+        scores = np.zeros(n)
+        matched = np.zeros(n, dtype=bool)
+        for q in divide_query(query):
+            q = self.parse(q)
+            docs = np.fromiter(searcher.docs_for_query(q), dtype=np.int64)
+            matched[docs] = True
+            for (docnum, _span), boost in _leaf_spans(searcher, q, progress).items():
+                scores[docnum] += boost
+        docnums = np.flatnonzero(matched)
+        return self.docmap(searcher.reader())[docnums], scores[docnums]
+
+    def _compact_frequencies(self, searcher, query: str):
+        """
+        Get the frequencies from an index without positions. Every occurrence of a term is a separate span,
+        so this counts the same as _frequencies: the term frequencies of the positive terms, weighted by the
+        boost of the last query of the term
+        """
+        n = searcher.doc_count_all()
+        scores = np.zeros(n)
+        matched = np.zeros(n, dtype=bool)
+        for q in divide_query(query):
+            q = self.parse(q)
+            docs = np.fromiter(searcher.docs_for_query(q), dtype=np.int64)
+            matched[docs] = True
+            weights = {}  # (docnum, term) -> (tf, boost), the last term query wins
+            for leaf, boost, allowed in _positive_leaves(searcher, q):
+                if not isinstance(leaf, wq.Term) or ("text", leaf.text) not in searcher.reader():
+                    continue
+                m = searcher.reader().postings("text", leaf.text)
+                while m.is_active():
+                    if allowed is None or m.id() in allowed:
+                        weights[m.id(), leaf.text] = (m.weight(), boost)
+                    m.next()
+            for (docnum, _text), (tf, boost) in weights.items():
+                scores[docnum] += tf * boost
+        docnums = np.flatnonzero(matched)
+        return self.docmap(searcher.reader())[docnums], scores[docnums]
+
+    @property
+    def schema(self):
+        return self.index.schema
+
+    def _expand_terms(self, q):
+        with self.index.reader() as reader:
+            return [text for _field, text in q.expanded_terms(reader)]
+
+    def _search_rows(self, query: str) -> np.ndarray:
+        self.require_positions(query)
+        with self.index.searcher() as searcher:
+            docnums = np.fromiter(searcher.docs_for_query(self.parse(query)), dtype=np.int64)
+            return np.sort(self.docmap(searcher.reader())[docnums])
+
+    def _preview(self, query: str, k, deadline, mask=None) -> Preview:
+        self.require_positions(query)
+        with self.index.searcher() as searcher:
+            docmap = self.docmap(searcher.reader())
+            matcher = self.parse(query).matcher(searcher)
+            rows = []
+            last = -1
+            while matcher.is_active() and len(rows) < k:
+                last = matcher.id()
+                row = int(docmap[last])
+                if mask is None or mask[row]:
+                    rows.append(row)
+                matcher.next()
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+            rows = np.sort(np.array(rows, dtype=np.int64))
+            if not matcher.is_active():
+                return Preview(rows, len(rows), True)
+            # the documents are searched in order, so estimate the total from the part of the index searched
+            n = searcher.doc_count_all()
+            return Preview(rows, int(round(len(rows) * n / (last + 1))), False)
+
+    @contextmanager
+    def _leaf_evaluator(self, q):
+        if uses_positions(q):
+            self.require_positions()
+        with self.index.searcher() as searcher:
+            docmap = self.docmap(searcher.reader())
+            yield lambda leaf: np.sort(docmap[np.fromiter(searcher.docs_for_query(leaf), dtype=np.int64)])
+
+    def _frequencies_list(self, queries, workers=1, progress: SearchProgress = None):
+        progress = progress or SearchProgress()
+        for q in queries:
+            self.require_positions(q)
+        if workers > 1 and len(queries) > 1 and self.directory is not None:
+            self.wait_for_merge()
+            with self.index.reader() as reader:
+                self.docmap(reader)  # make sure the workers can load the docmap of the current generation
+            return _parallel_frequencies(self.directory, queries, workers, progress)
+        with self.index.searcher(weighting=scoring.Frequency) as searcher:
+            return search_sequentially(queries, lambda q: self._frequencies(searcher, q, progress), progress)
+
+    def _match_spans(self, query: str):
+        self.require_positions()
+        query = self.parse(query)
+        doc, start, end = [], [], []
+        with self.index.searcher() as searcher:
+            docmap = self.docmap(searcher.reader())
+            docnums = np.fromiter(searcher.docs_for_query(query), dtype=np.int64)
+            for docnum, span in _leaf_spans(searcher, query):
+                doc.append(docnum)
+                start.append(span.start)
+                end.append(span.end)
+            rows = docmap[docnums]
+            doc = docmap[np.array(doc, dtype=np.int64)]
+        start, end = np.array(start, dtype=np.int64), np.array(end, dtype=np.int64)
+        order = np.lexsort((start, doc))
+        return np.sort(rows), (doc[order], start[order], end[order])
+
+    def _term_arrays(self):
+        # one pass over the term dictionary, reading the statistics from the term infos
         with self.index.reader() as r:
-            for t in r.field_terms('text'):
-                yield t, r.doc_frequency('text', t), r.frequency('text', t)
+            terms, docfreq, termfreq = [], [], []
+            for text, info in r.iter_field('text'):
+                terms.append(text.decode("utf-8"))
+                docfreq.append(info.doc_frequency())
+                termfreq.append(info.weight())
+        result = np.empty(len(terms), dtype=object)
+        result[:] = terms
+        return result, np.array(docfreq, dtype=np.int64), np.array(termfreq, dtype=np.int64)
+
+    def memory_usage(self) -> int:
+        usage = super().memory_usage()
+        if self.directory is None and self.index is not None:
+            # the files of a RAM index
+            usage += sum(len(f) for f in self.index.storage.files.values())
+        return usage
+
+    def _free(self):
+        self.wait_for_merge()
+        self.index = None
+        self._docmaps = {}
+        super()._free()
 
     def reader(self, *args, **kargs):
         return self.index.reader(*args, **kargs)
 
 
+def _positive_leaves(searcher, q, boost=None, allowed=None):
+    """
+    Yield (leaf query, boost, allowed docnums) for the positive term and phrase queries in q. A leaf only counts
+    in the documents matched by all its enclosing (sub)queries (allowed, None for all documents), and the
+    outermost boost applies. The leaves of NOT clauses only exclude documents, so they are skipped
+    """
+    if boost is None and q.boost != 1:
+        boost = q.boost
+    if isinstance(q, (wq.Term, wq.Prefix, wq.Wildcard, wq.Phrase)):
+        yield q, 1.0 if boost is None else boost, allowed
+        return
+    if isinstance(q, (wq.And, wq.Or)):
+        children = [s for s in q.subqueries if not isinstance(s, wq.Not)]
+    elif isinstance(q, (wq.AndNot, wq.AndMaybe)):
+        children = [q.a]
+    else:
+        return
+    docs = set(searcher.docs_for_query(q))
+    allowed = docs if allowed is None else allowed & docs
+    for child in children:
+        yield from _positive_leaves(searcher, child, boost, allowed)
+
+
+def _leaf_spans(searcher, q, progress: SearchProgress = None):
+    """
+    Get the spans of the positive leaves of q as a {(docnum, span): boost} dictionary. Identical spans
+    (e.g. of a term used twice) are counted once, with the boost of the last leaf
+    """
+    spans = {}
+    steps = 0
+    for leaf, boost, allowed in _positive_leaves(searcher, q):
+        m = leaf.matcher(searcher)
+        while m.is_active():
+            if allowed is None or m.id() in allowed:
+                for span in m.spans():
+                    spans[m.id(), span] = boost
+            m.next()
+            steps += 1
+            if progress is not None and steps % 1000 == 0:
+                progress.check()
+    return spans
+
+
+def _index_chunk(directory, start, tokens, limitmb):
+    """
+    Index the documents (numbered from start) into a new segment of the index in directory, and return the segment.
+    The calling process should hold the lock on the index and add the segment to the index.
+    """
+    w = SegmentWriter(open_dir(directory), _lk=False, limitmb=limitmb)
+    for doc_i, doc_tokens in enumerate(tokens, start=start):
+        w.add_document(text=doc_tokens, doc_i=doc_i)
+    # the temporary storage is shared with the calling process, which removes it when committing
+    return w._finalize_segment()
+
+
+def _frequencies_worker(directory, queries):
+    return Index(None, directory=directory)._frequencies_list(queries)
+
+
+def _parallel_frequencies(directory, queries, workers, progress: SearchProgress):
+    """
+    Compute the frequencies of the queries in a pool of worker processes that each open the index read-only.
+    Progress is reported (and cancellation checked) per completed chunk of queries
+    :return: list of (rows, frequencies) pairs, in the order of the queries
+    """
+    # use a few chunks per worker so a chunk of slow queries does not keep the other workers waiting
+    chunksize = math.ceil(len(queries) / (workers * 4))
+    results = [None] * len(queries)
+    pool = ProcessPoolExecutor(max_workers=workers)
+    cancelled = False
+    try:
+        pending = {pool.submit(_frequencies_worker, directory, queries[i:i + chunksize]): i
+                   for i in range(0, len(queries), chunksize)}
+        futures = dict(pending)
+        while pending:
+            # poll the cancellation token while waiting for the workers
+            done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = future.result()
+                i = futures[future]
+                results[i:i + len(chunk)] = chunk
+                progress.done(len(chunk))
+            progress.check(results)
+    except SearchCancelled as e:
+        cancelled = True
+        for future in pending:
+            future.cancel()
+        e.results = results
+        raise
+    finally:
+        # don't wait for the running chunks of a cancelled search
+        pool.shutdown(wait=not cancelled)
+    return results
+
+
+def fingerprints(tokens, prefixes=()) -> dict:
+    """
+    Compute a hash of the content of the tokens, used as key for the persistent index cache.
+    The keys of the first n documents (for each n in prefixes) are computed in the same pass.
+    :return: a dict of {n: key}, containing all prefix lengths and the number of documents
+    """
+    prefixes = set(prefixes)
+    result = {}
+    h = hashlib.sha1()
+    n = 0
+    for n, doc_tokens in enumerate(tokens, start=1):
+        h.update("\x1f".join(doc_tokens).encode("utf-8"))
+        h.update(b"\x1e")
+        if n in prefixes:
+            result[n] = "v{}-{}-{}".format(INDEX_VERSION, n, h.hexdigest())
+    result[n] = "v{}-{}-{}".format(INDEX_VERSION, n, h.hexdigest())
+    return result
+
+
+def fingerprint(tokens) -> str:
+    """
+    Compute a hash of the content of the tokens, as in the keys of the persistent index cache (see fingerprints).
+    Sharded indexes store it to check whether their shards are of the same documents
+    """
+    return fingerprints(tokens)[len(tokens)]
+
+
+def _key_ndocs(key):
+    m = re.match(r"v(\d+)-(\d+)-\w+(-compact)?$", key)
+    if m and int(m.group(1)) == INDEX_VERSION:
+        return int(m.group(2))
+
+
+def _is_prefix(tokens, new_tokens):
+    """Are the documents in tokens the first documents of new_tokens?"""
+    return len(tokens) <= len(new_tokens) and all(a is b or list(a) == list(b) for (a, b) in zip(tokens, new_tokens))
+
+
+def _directory_size(path):
+    size = 0
+    for dirpath, _dirs, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, f))
+            except OSError:
+                # removed in the meantime, e.g. by a background merge of the segments
+                pass
+    return size
+
+
+# estimated memory per element of an object array (e.g. the terms), on top of the pointer
+OBJECT_BYTES = 64
+
+
+def _nbytes(value, exclude=None) -> int:
+    """Estimate the memory used by the arrays, bitmaps and fields in value (and in the containers in value)"""
+    if value is exclude or isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes + (value.size * OBJECT_BYTES if value.dtype == object else 0)
+    if isinstance(value, Bitmap):
+        return value.nbytes
+    if isinstance(value, FieldIndex):
+        return _nbytes(value.values) + _nbytes(value.categories) + _nbytes(value._buckets)
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v, exclude) for v in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v, exclude) for v in value.values())
+    return 0
+
+
+class IndexCache(object):
+    """
+    Persistent store of indices on disk, keyed by the fingerprint of the indexed tokens.
+    If the total size of the stored indices exceeds max_size_mb, the least recently used indices are removed.
+    """
+
+    def __init__(self, directory, max_size_mb=2048):
+        self.directory = directory
+        self.max_size_mb = max_size_mb
+        os.makedirs(directory, exist_ok=True)
+        self._lock = Lock()
+        self._in_use = WeakSet()  # Index objects opened from this cache
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key: str):
+        return exists_in(self.path(key))
+
+    def prefix_candidates(self, n_docs):
+        """
+        Get the number of documents of all cached indices that are smaller than n_docs
+        """
+        return {n for n in map(_key_ndocs, os.listdir(self.directory)) if n is not None and n < n_docs}
+
+    def open(self, corpus: Corpus, key: str, base: str = None, **kargs) -> Index:
+        """
+        Open the index stored under key, creating it from the corpus if it is not in the cache
+        :param base: Key of a cached index of the first documents of the corpus. If given, a new index
+                     is created by appending the remaining documents to (a copy of) this index
+        """
+        path = self.path(key)
+        if not exists_in(path):
+            # build in a temporary directory and move it into place, so an interrupted build is never reused
+            building = os.path.join(self.directory, ".building-" + uuid4().hex)
+            try:
+                if base is None:
+                    os.makedirs(building)
+                    Index(corpus, directory=building, **kargs)
+                else:
+                    self._take(base, building)
+                    # the base index (and its key) already determines whether there are positions
+                    for name in ("procs", "monitor", "positions"):
+                        kargs.pop(name, None)
+                    Index(corpus, directory=building).append(corpus, merge=False, **kargs)
+                os.rename(building, path)
+            except OSError:
+                # another process created the same index in the meantime
+                if not exists_in(path):
+                    raise
+            finally:
+                if os.path.exists(building):
+                    shutil.rmtree(building, ignore_errors=True)
+        ix = Index(corpus, directory=path)
+        with self._lock:
+            self._in_use.add(ix)
+        os.utime(path)  # mark as recently used
+        if base is not None:
+            ix.merge_segments()
+        self.evict()
+        return ix
+
+    def _take(self, key, target):
+        """Move the index stored under key to the target directory, or copy it if it is in use"""
+        path = self.path(key)
+        with self._lock:
+            in_use = {os.path.abspath(ix.directory) for ix in self._in_use}
+            if os.path.abspath(path) in in_use:
+                shutil.copytree(path, target)
+            else:
+                os.rename(path, target)
+
+    def entries(self):
+        """
+        Get the cached indices as a list of (key, size in bytes, last used) triples, least recently used first
+        """
+        result = []
+        for key in os.listdir(self.directory):
+            path = self.path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            result.append((key, _directory_size(path), os.path.getmtime(path)))
+        return sorted(result, key=lambda e: e[2])
+
+    def evict(self):
+        """
+        Remove least recently used indices until the cache is within its size limit.
+        Indices that are currently opened are never removed.
+        """
+        with self._lock:
+            in_use = {os.path.abspath(ix.directory) for ix in self._in_use}
+            entries = self.entries()
+            total = sum(size for _key, size, _mtime in entries)
+            for key, size, _mtime in entries:
+                if total <= self.max_size_mb * 1024 * 1024:
+                    break
+                path = self.path(key)
+                if os.path.abspath(path) in in_use:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        """Remove all indices that are not currently opened"""
+        max_size_mb, self.max_size_mb = self.max_size_mb, 0
+        try:
+            self.evict()
+        finally:
+            self.max_size_mb = max_size_mb
+
+
+def _engines():
+    from orangecontrib.sma.numpy_index import NumpyIndex
+    from orangecontrib.sma.sharded_index import ShardedIndex
+    return {"whoosh": Index, "numpy": NumpyIndex, "sharded": ShardedIndex}
+
+
+_INDEX_CACHE = None
+
+
+def set_index_cache(directory: str = None, max_size_mb=2048) -> IndexCache:
+    """
+    Configure the persistent index cache used by get_index.
+    If directory is None, indices are not stored persistently but created in a temporary directory.
+    """
+    global _INDEX_CACHE
+    with _GLOBAL_LOCK:
+        _INDEX_CACHE = None if directory is None else IndexCache(directory, max_size_mb=max_size_mb)
+    return _INDEX_CACHE
+
+
+def get_index_cache() -> IndexCache:
+    """
+    Get the persistent index cache, by default located in the directory given by the ORANGE3SMA_INDEX_CACHE
+    environment variable or in the Orange cache directory.
+    """
+    global _INDEX_CACHE
+    with _GLOBAL_LOCK:
+        if _INDEX_CACHE is None:
+            directory = os.environ.get("ORANGE3SMA_INDEX_CACHE")
+            if directory is None:
+                from Orange.misc.environ import cache_dir
+                directory = os.path.join(cache_dir(), "orange3sma_index")
+            _INDEX_CACHE = IndexCache(directory)
+        return _INDEX_CACHE
+
+
+class IndexRegistry(object):
+    """
+    Process-wide registry of the indexes created by get_index, tracked through weak references so the registry does
+    not keep them alive. If the temporary files (disk) or the memory (RAM) of the indexes exceed the budgets, the least
+    recently used indexes are released (see BaseIndex.release). get_index recreates the index of a corpus if it is
+    needed again. Indexes opened from the persistent IndexCache do not count for the disk budget, as the cache has
+    its own size limit. Budgets of None are unlimited.
+
+    Indexes that are in use (being searched or extended, see BaseIndex.in_use) are not released. Memory reserved
+    for the write buffers of indexes that are being built (see reserve) is a worst-case estimate, so it does not
+    release indexes by itself, and counts for at most max_reserved_fraction of the memory budget.
+    """
+
+    max_reserved_fraction = 0.25
+
+    def __init__(self, max_disk_mb=None, max_ram_mb=None):
+        self.max_disk_mb = max_disk_mb
+        self.max_ram_mb = max_ram_mb
+        self._lock = Lock()
+        self._indexes = OrderedDict()  # {id: weak reference}, least recently used first
+        self._reserved_mb = 0
+
+    def register(self, ix: BaseIndex):
+        """Add the index (or mark it as used, if it is registered) and release other indexes if needed"""
+        key = id(ix)
+        with self._lock:
+            if key in self._indexes and self._indexes[key]() is ix:
+                self._indexes.move_to_end(key)
+            else:
+                self._indexes[key] = ref(ix, lambda r, key=key: self._forget(key, r))
+        self.enforce(keep=ix)
+
+    def _forget(self, key, r):
+        # called when the index is garbage collected. The id may already have been reused by a new index
+        if self._indexes.get(key) is r:
+            self._indexes.pop(key, None)
+
+    def touch(self, ix: BaseIndex):
+        """Mark the index (or the parent of an index view) as recently used"""
+        ix = getattr(ix, "parent", ix)
+        with self._lock:
+            r = self._indexes.get(id(ix))
+            if r is not None and r() is ix:
+                self._indexes.move_to_end(id(ix))
+
+    def indexes(self) -> list:
+        """Get the live registered indexes, least recently used first"""
+        with self._lock:
+            refs = list(self._indexes.values())
+        return [ix for ix in (r() for r in refs) if ix is not None and not ix.released]
+
+    def usage(self) -> dict:
+        """Get the number of indexes, their disk and memory usage and the budgets (in MB)"""
+        indexes = self.indexes()
+        return dict(indexes=len(indexes),
+                    disk_mb=sum(ix.disk_usage() for ix in indexes) / 1024 / 1024,
+                    ram_mb=sum(ix.memory_usage() for ix in indexes) / 1024 / 1024 + self._reserved_mb,
+                    reserved_ram_mb=self._reserved_mb,
+                    max_disk_mb=self.max_disk_mb, max_ram_mb=self.max_ram_mb)
+
+    @contextmanager
+    def reserve(self, ram_mb):
+        """Count ram_mb (e.g. the write buffers of an indexing process) as used while in this context"""
+        with self._lock:
+            self._reserved_mb += ram_mb
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reserved_mb -= ram_mb
+
+    def _counted_reservations(self):
+        if self.max_ram_mb is None:
+            return self._reserved_mb
+        return min(self._reserved_mb, self.max_ram_mb * self.max_reserved_fraction)
+
+    def enforce(self, keep: BaseIndex = None):
+        """Release least recently used indexes (except keep) until the usage is within the budgets"""
+        if self.max_disk_mb is None and self.max_ram_mb is None:
+            return
+        entries = [(ix, ix.disk_usage(), ix.memory_usage()) for ix in self.indexes()]
+        disk = sum(d for _ix, d, _r in entries) / 1024 / 1024
+        ram = sum(r for _ix, _d, r in entries) / 1024 / 1024 + self._counted_reservations()
+        for ix, d, r in entries:
+            over_disk = self.max_disk_mb is not None and disk > self.max_disk_mb
+            over_ram = self.max_ram_mb is not None and ram > self.max_ram_mb
+            if not (over_disk or over_ram):
+                break
+            if ix is keep or ix.busy or not ((over_disk and d) or (over_ram and r)):
+                continue
+            ix.release()
+            if not ix.released:
+                continue
+            log.info("Released {} index of {} documents ({:.1f} MB disk, {:.1f} MB memory) to stay within the "
+                     "index budget".format(ix.engine, ix.n_docs, d / 1024 / 1024, r / 1024 / 1024))
+            disk -= d / 1024 / 1024
+            ram -= r / 1024 / 1024
+            with self._lock:
+                self._indexes.pop(id(ix), None)
+
+
+# default budgets of the index registry, can be set with the ORANGE3SMA_INDEX_DISK_MB and ORANGE3SMA_INDEX_RAM_MB
+# environment variables
+MAX_INDEX_DISK_MB = 8192
+MAX_INDEX_RAM_MB = 2048
+
+_INDEX_REGISTRY = None
+
+
+def set_index_registry(max_disk_mb=MAX_INDEX_DISK_MB, max_ram_mb=MAX_INDEX_RAM_MB) -> IndexRegistry:
+    """
+    Configure the budgets (in MB, None for unlimited) of the index registry. Indexes registered so far are kept
+    """
+    registry = get_index_registry()
+    registry.max_disk_mb = max_disk_mb
+    registry.max_ram_mb = max_ram_mb
+    registry.enforce()
+    return registry
+
+
+def get_index_registry() -> IndexRegistry:
+    """Get the process-wide IndexRegistry"""
+    global _INDEX_REGISTRY
+    with _GLOBAL_LOCK:
+        if _INDEX_REGISTRY is None:
+            disk = os.environ.get("ORANGE3SMA_INDEX_DISK_MB")
+            ram = os.environ.get("ORANGE3SMA_INDEX_RAM_MB")
+            _INDEX_REGISTRY = IndexRegistry(MAX_INDEX_DISK_MB if disk is None else float(disk),
+                                            MAX_INDEX_RAM_MB if ram is None else float(ram))
+        return _INDEX_REGISTRY
+
+
+# estimated size of a whoosh index per token (postings with positions, stored fields and the docmap)
+INDEX_BYTES_PER_TOKEN = 24
+# RAM storage is used for corpora with an estimated index size below this (and a fourth of the available memory)
+MAX_RAM_INDEX_MB = 512
+
+
+def available_memory():
+    """Get the available physical memory in bytes, or None if this cannot be determined on this platform"""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def choose_storage(tokens) -> str:
+    """
+    Choose "ram" or "disk" storage for a whoosh index of the given tokens: small corpora are indexed in memory,
+    which avoids the disk I/O of building and opening the index, larger corpora on disk (and in the index cache)
+    """
+    n_tokens = sum(len(doc_tokens) for doc_tokens in tokens)
+    size = n_tokens * INDEX_BYTES_PER_TOKEN
+    limit = MAX_RAM_INDEX_MB * 1024 * 1024
+    available = available_memory()
+    if available is not None:
+        limit = min(limit, available // 4)
+    return "ram" if size < limit else "disk"
+
+
 @monitored(100, "Indexing corpus")
-def get_index(corpus: Corpus, monitor: ProgressMonitor, multiple_processors=False, **kargs) -> Index:
+def get_index(corpus: Corpus, monitor: ProgressMonitor, multiple_processors=False, cache=True, engine="whoosh",
+              workers=1, storage="auto", positions=True, fields=None, procs=None, **kargs) -> BaseIndex:
     """
     Get the index for the provided corpus, reindexing (and tokenizing) if needed
+
+    :param multiple_processors: If True (and procs is not given), build the index with all but one of the CPUs
+    :param procs: Number of processes to build the index with
+    :param workers: Default number of worker processes used to search the index (see BaseIndex.search_many)
+    :param engine: The index engine to use: "whoosh" (on disk), "numpy" (in memory, faster for smaller corpora) or
+                   "sharded" (whoosh indexes of row ranges searched in parallel, for very large corpora; the number of
+                   shards can be given as shards=n)
+    :param cache: If True, reuse or store the index in the persistent index cache (see get_index_cache).
+                  Can also be an IndexCache object, or False to always create a new temporary index
+    :param storage: Storage of a whoosh index: "ram", "disk", or "auto" to choose based on the number of tokens
+                    and the available memory (see choose_storage). RAM indexes are not stored in the index cache.
+                    Use BaseIndex.latency() to compare the build and query times of the modes
+    :param positions: If False, a new whoosh index is created without term positions, which is smaller and faster
+                      to build. It is upgraded to a positional index when a query or get_context needs positions
+    :param fields: Corpus variables (e.g. ["Publication Date", "Medium"]) to add as fields that can be used to
+                   filter searches, or a dict of {name: kind}, see fields.corpus_fields and BaseIndex.add_fields
     """
     with _GLOBAL_LOCK:
         if not hasattr(corpus, "_orange3sma_index_lock"):
             corpus._orange3sma_index_lock = Lock()
     with corpus._orange3sma_index_lock:
         ix = getattr(corpus, "_orange3sma_index", None)
-        if not (ix and ix.tokens is corpus._tokens):
+        if isinstance(ix, IndexView) and ix.stale and not ix.released:
+            # the rows of the view are still in the parent, but its remap does not cover the new documents
+            ix = corpus._orange3sma_index = ix.parent.subset(ix.rows, ix.tokens)
+        reuse = ix and ix.tokens is corpus._tokens and ix.engine == engine and not ix.released
+        if engine == "whoosh":
+            if storage == "auto":
+                storage = ix.storage if reuse else choose_storage(corpus.tokens)
+            reuse = reuse and ix.storage == storage
+            if reuse and positions:
+                ix.require_positions()
+        if not reuse:
             monitor.update(0, "Getting tokens")
             corpus.tokens  # force tokens
-            procs = max(1, multiprocessing.cpu_count()-1) if multiple_processors else 1
-            monitor.update(50, "Creating index")
-            ix = Index(corpus, procs=procs, **kargs)
+            if ix and ix.engine != engine:
+                ix = None
+            if procs is None:
+                procs = max(1, multiprocessing.cpu_count()-1) if multiple_processors else 1
+            if cache is True:
+                cache = get_index_cache()
+            start = time.perf_counter()
+            if engine != "whoosh":
+                monitor.update(50, "Creating index")
+                ix = _engines()[engine](corpus, procs=procs, monitor=monitor.submonitor(50), **kargs)
+            elif storage == "ram":
+                monitor.update(50, "Creating index in memory")
+                ix = Index(corpus, procs=1, monitor=monitor.submonitor(50), storage="ram", positions=positions, **kargs)
+            elif cache:
+                monitor.update(25, "Fingerprinting tokens")
+                n = len(corpus.tokens)
+                keys = fingerprints(corpus.tokens, cache.prefix_candidates(n))
+                if not (positions or keys[n] in cache):
+                    # a compact index is only created if there is no positional index of the corpus
+                    keys = {n_docs: key + "-compact" for n_docs, key in keys.items()}
+                key = keys.pop(n)
+                # if the corpus was extended with new documents, only index the new documents
+                base = max((k for k in keys.values() if k in cache), key=_key_ndocs, default=None)
+                if key in cache:
+                    message = "Opening index"
+                elif base is not None:
+                    message = "Adding {} documents to index".format(n - _key_ndocs(base))
+                else:
+                    message = "Creating index"
+                monitor.update(25, message)
+                ix = cache.open(corpus, key, base=None if key in cache else base, procs=procs,
+                                monitor=monitor.submonitor(50), positions=positions, **kargs)
+            elif isinstance(ix, Index) and ix.storage == "disk" and _is_prefix(ix.tokens, corpus.tokens):
+                monitor.update(50, "Adding {} documents to index".format(len(corpus.tokens) - len(ix.tokens)))
+                ix.append(corpus)
+                if positions:
+                    ix.require_positions()
+            else:
+                monitor.update(50, "Creating index")
+                ix = Index(corpus, procs=procs, monitor=monitor.submonitor(50), positions=positions, **kargs)
+            # time to get (build, update or open) the index, as reported by BaseIndex.latency
+            ix.build_seconds = time.perf_counter() - start
+            log.info("Got {} index ({} storage) in {:.2f}s".format(ix.engine, ix.storage, ix.build_seconds))
             corpus._orange3sma_index = ix
+        ix.workers = workers
+        if fields:
+            # fields of an index that was extended with new documents have to be recomputed as well
+            if not isinstance(fields, dict):
+                fields = dict.fromkeys(fields)
+            missing = {name: kind for name, kind in fields.items()
+                       if name not in ix.fields or len(ix.fields[name]) != ix.n_docs}
+            if missing:
+                monitor.update(0, "Indexing fields")
+                ix.add_fields(corpus_fields(corpus, missing))
+        if not isinstance(ix, IndexView):
+            get_index_registry().register(ix)
     return ix
 
 
+def attach_subset_index(corpus: Corpus, subset: Corpus, rows):
+    """
+    If corpus has an index, attach a view on it to subset = corpus[rows], so get_index(subset) does not reindex.
+    The tokens of subset should not have been changed.
+    """
+    ix = getattr(corpus, "_orange3sma_index", None)
+    if ix is not None and ix.tokens is corpus._tokens and subset._tokens is not None:
+        view = ix.subset(rows, subset._tokens)
+        if view is not None:
+            subset._orange3sma_index = view
+    return subset
+
+
 def divide_query(query):
     """
     divide query into parts connected by OR statements (that can be executed separately)
@@ -130,23 +1973,6 @@ def divide_query(query):
             queries[-1] += q
     return queries
 
-def boostdict(m, bd=None):
-    """
-    Get a dictionary with boost (i.e. weight) scores (dict values) for different spans (dict keys)
-    """
-    if bd is None:
-        bd = {}
-    if m.is_active():
-        if hasattr(m, 'boost'):
-            for s in m.spans():
-                bd[s] = float(m.boost)
-                return bd
-        if hasattr(m, 'children'):
-            children = m.children()
-            for child in m.children():
-                bd = boostdict(child, bd)
-    return bd
-
 if __name__ == '__main__':
     from Orange import data
     from orangecontrib.text.corpus import Corpus
@@ -0,0 +1,237 @@
+"""
+In-memory index engine that stores postings as NumPy arrays.
+
+The postings are stored in CSR form over an interned (sorted) vocabulary: all occurrences of term t
+are in occ_doc[term_ptr[t]:term_ptr[t+1]] and occ_pos[term_ptr[t]:term_ptr[t+1]], sorted by document
+and position. Queries are parsed with the whoosh query parser (so the query syntax is identical to the
+whoosh engine) and evaluated as vectorized set operations on these arrays.
+"""
+import re
+from contextlib import contextmanager
+
+import numpy as np
+from whoosh import query as wq
+
+from orangecontrib.sma.index import (BaseIndex, OBJECT_BYTES, SearchProgress, divide_query, expand_ranges,
+                                     index_schema, search_sequentially)
+
+
+def _union(arrays):
+    arrays = [a for a in arrays if len(a)]
+    if not arrays:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(arrays))
+
+
+def _intersect(arrays):
+    result = arrays[0]
+    for a in arrays[1:]:
+        result = np.intersect1d(result, a, assume_unique=True)
+    return result
+
+
+def _span_keys(doc, start, end):
+    return np.rec.fromarrays([doc, start, end], names="doc,start,end")
+
+
+class NumpyIndex(BaseIndex):
+    """Index engine that keeps NumPy postings arrays in memory"""
+
+    engine = "numpy"
+
+    def __init__(self, corpus, **kargs):
+        self.tokens = corpus.tokens
+        # forward index: token ids of document d are token_ids[doc_ptr[d]:doc_ptr[d+1]]
+        self.terms, self.token_ids, self.doc_ptr = self.forward_index
+        self.term_ids = {t: i for i, t in enumerate(self.terms)}
+        lengths = np.diff(self.doc_ptr)
+        self._doc_lengths = (self.tokens, lengths)
+        # inverted index
+        docs = np.repeat(np.arange(self.n_docs), lengths)
+        positions = np.arange(len(self.token_ids)) - np.repeat(self.doc_ptr[:-1], lengths)
+        by_term = np.argsort(self.token_ids, kind="stable")
+        self.occ_doc = docs[by_term]
+        self.occ_pos = positions[by_term]
+        self.term_ptr = np.concatenate([[0], np.cumsum(np.bincount(self.token_ids, minlength=len(self.terms)))])
+        self._schema = index_schema()
+
+    @property
+    def schema(self):
+        return self._schema
+
+    def _expand_terms(self, q):
+        return self.terms[self._expand(q)].tolist()
+
+    def _term_range(self, t):
+        return slice(self.term_ptr[t], self.term_ptr[t + 1])
+
+    def _expand(self, q):
+        """Get the ids of the vocabulary terms matching a term, prefix or wildcard query"""
+        if isinstance(q, wq.Prefix):
+            lo = np.searchsorted(self.terms, q.text, side="left")
+            hi = np.searchsorted(self.terms, q.text + "\U0010ffff", side="right")
+            return list(range(lo, hi))
+        if isinstance(q, wq.Wildcard):
+            pattern = re.compile("".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in q.text) + "$")
+            prefix = re.match(r"[^*?]*", q.text).group(0)
+            start = np.searchsorted(self.terms, prefix, side="left") if prefix else 0
+            result = []
+            for t in range(start, len(self.terms)):
+                term = self.terms[t]
+                if prefix and not term.startswith(prefix):
+                    break
+                if pattern.match(term):
+                    result.append(t)
+            return result
+        t = self.term_ids.get(q.text)
+        return [] if t is None else [t]
+
+    def _leaf_occurrences(self, q):
+        """Get (doc, start, end) arrays of all occurrences of a term, prefix, wildcard or phrase query"""
+        if isinstance(q, wq.Phrase):
+            ids = [self.term_ids.get(w) for w in q.words]
+            if not ids or None in ids:
+                return (np.empty(0, dtype=np.int64),) * 3
+            if q.slop != 1:
+                return self._near_occurrences(ids, q.slop)
+            # key of each occurrence is (doc, position of the first word of the phrase)
+            keys = None
+            for i, t in enumerate(ids):
+                r = self._term_range(t)
+                k = (self.occ_doc[r].astype(np.int64) << 32) + (self.occ_pos[r] - i)
+                keys = k if keys is None else np.intersect1d(keys, k, assume_unique=True)
+            start = keys & 0xFFFFFFFF
+            return keys >> 32, start, start + len(ids) - 1
+        ranges = [self._term_range(t) for t in self._expand(q)]
+        doc = np.concatenate([self.occ_doc[r] for r in ranges] or [np.empty(0, dtype=np.int64)])
+        pos = np.concatenate([self.occ_pos[r] for r in ranges] or [np.empty(0, dtype=np.int64)])
+        return doc, pos, pos
+
+    def _near_occurrences(self, ids, slop):
+        """
+        Get (doc, start, end) arrays of the occurrences of a phrase with slop, matched like the whoosh SpanNear2
+        query: each next word follows the span of the previous words at a distance of 1 to slop positions
+        """
+        r = self._term_range(ids[0])
+        doc, start = self.occ_doc[r].astype(np.int64), self.occ_pos[r].astype(np.int64)
+        end = start
+        for t in ids[1:]:
+            r = self._term_range(t)
+            # the occurrences of a term are sorted by document and position, so the candidates of each span
+            # are a range of these keys
+            keys = (self.occ_doc[r].astype(np.int64) << 32) + self.occ_pos[r]
+            lo = np.searchsorted(keys, (doc << 32) + end + 1, side="left")
+            hi = np.searchsorted(keys, (doc << 32) + end + slop, side="right")
+            found = expand_ranges(lo, hi)
+            doc, start = np.repeat(doc, hi - lo), np.repeat(start, hi - lo)
+            end = keys[found] & 0xFFFFFFFF
+            # spans reached through different occurrences of the middle words are counted once
+            spans = np.unique(_span_keys(doc, start, end))
+            doc, start, end = (spans[f].astype(np.int64) for f in ("doc", "start", "end"))
+        return doc, start, end
+
+    def _docs(self, q) -> np.ndarray:
+        """Evaluate the query, returning the sorted array of matching documents"""
+        if isinstance(q, (wq.Term, wq.Prefix, wq.Wildcard, wq.Phrase)):
+            doc = self._leaf_occurrences(q)[0]
+            return np.unique(doc)
+        if isinstance(q, wq.And):
+            positive = [self._docs(s) for s in q.subqueries if not isinstance(s, wq.Not)]
+            result = _intersect(positive) if positive else np.arange(self.n_docs)
+            negative = [self._docs(s.query) for s in q.subqueries if isinstance(s, wq.Not)]
+            return np.setdiff1d(result, _union(negative), assume_unique=True) if negative else result
+        if isinstance(q, wq.Or):
+            return _union([self._docs(s) for s in q.subqueries])
+        if isinstance(q, wq.Not):
+            return np.setdiff1d(np.arange(self.n_docs), self._docs(q.query), assume_unique=True)
+        if isinstance(q, wq.AndNot):
+            return np.setdiff1d(self._docs(q.a), self._docs(q.b), assume_unique=True)
+        if isinstance(q, wq.AndMaybe):
+            return self._docs(q.a)
+        if isinstance(q, wq.Every):
+            return np.arange(self.n_docs)
+        if q is wq.NullQuery or isinstance(q, type(wq.NullQuery)):
+            return np.empty(0, dtype=np.int64)
+        raise ValueError("Query {!r} is not supported by the numpy engine".format(q))
+
+    def _spans(self, q, boost=None):
+        """
+        Yield (doc, start, end, weight) arrays for the positive leaves of the query, in the documents matched
+        by each enclosing (sub)query. As in the whoosh engine (see _positive_leaves), the outermost boost (weight)
+        applies to all spans below it, and the leaves of NOT clauses count nothing
+        """
+        if boost is None and q.boost != 1:
+            boost = q.boost
+        if isinstance(q, (wq.Term, wq.Prefix, wq.Wildcard, wq.Phrase)):
+            doc, start, end = self._leaf_occurrences(q)
+            yield doc, start, end, np.full(len(doc), 1.0 if boost is None else boost)
+            return
+        if isinstance(q, (wq.And, wq.Or)):
+            children = [s for s in q.subqueries if not isinstance(s, wq.Not)]
+        elif isinstance(q, (wq.AndNot, wq.AndMaybe)):
+            children = [q.a]
+        else:
+            return
+        docs = self._docs(q)
+        for child in children:
+            for doc, start, end, weight in self._spans(child, boost):
+                keep = np.isin(doc, docs)
+                yield doc[keep], start[keep], end[keep], weight[keep]
+
+    def _matching_spans(self, q):
+        """Get the matching documents and their unique (doc, start, end, weight) spans, sorted"""
+        docs = self._docs(q)
+        parts = list(self._spans(q))
+        if not parts:
+            return docs, (np.empty(0, dtype=np.int64),) * 3 + (np.empty(0),)
+        doc, start, end, weight = (np.concatenate(x) for x in zip(*parts))
+        # identical spans are counted once, with the weight of the last (like the whoosh engine)
+        keys = _span_keys(doc, start, end)[::-1]
+        _, first = np.unique(keys, return_index=True)
+        idx = len(doc) - 1 - first
+        return docs, (doc[idx], start[idx], end[idx], weight[idx])
+
+    def _frequencies(self, query: str):
+        """
+        Get the rows matching the query and their (weighted) frequencies as a pair of arrays
+        """
+        scores = np.zeros(self.n_docs)
+        matched = np.zeros(self.n_docs, dtype=bool)
+        for q in divide_query(query):
+            docs, (doc, _start, _end, weight) = self._matching_spans(self.parse(q))
+            matched[docs] = True
+            scores += np.bincount(doc, weights=weight, minlength=self.n_docs)
+        rows = np.flatnonzero(matched)
+        return rows, scores[rows]
+
+    def _search_rows(self, query: str):
+        return self._docs(self.parse(query))
+
+    @contextmanager
+    def _leaf_evaluator(self, q):
+        yield self._docs
+
+    def _frequencies_list(self, queries, workers=1, progress: SearchProgress = None):
+        # workers is ignored: the arrays are in memory, and the queries are evaluated vectorized
+        return search_sequentially(queries, self._frequencies, progress or SearchProgress())
+
+    def _match_spans(self, query: str):
+        docs, (doc, start, end, _weight) = self._matching_spans(self.parse(query))
+        return docs, (doc, start, end)
+
+    def memory_usage(self) -> int:
+        return super().memory_usage() + len(self.term_ids) * OBJECT_BYTES
+
+    def _free(self):
+        self.terms = self.token_ids = self.doc_ptr = self.occ_doc = self.occ_pos = self.term_ptr = None
+        self.term_ids = {}
+        super()._free()
+
+    def _term_arrays(self):
+        # the occurrences of each term are sorted by document, so count the changes of document within each term
+        termfreq = np.diff(self.term_ptr)
+        new_doc = np.ones(len(self.occ_doc), dtype=np.int64)
+        new_doc[1:] = self.occ_doc[1:] != self.occ_doc[:-1]
+        new_doc[self.term_ptr[:-1][termfreq > 0]] = 1
+        docfreq = np.add.reduceat(new_doc, self.term_ptr[:-1]) if len(self.occ_doc) else termfreq
+        return self.terms, docfreq, termfreq
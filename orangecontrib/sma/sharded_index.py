@@ -0,0 +1,249 @@
+"""
+Index engine for very large corpora that partitions the documents into shards.
+
+Each shard is an independent (positional, on disk) whoosh Index of a contiguous range of corpus rows,
+bounds[i]:bounds[i+1], numbered from 0 within the shard. The shards are built in parallel, and searches are
+scattered over a pool of worker processes (each keeping its shards open) and gathered in row order by shifting
+the rows of each shard by its first row.
+"""
+import math
+import os
+import shutil
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+
+import numpy as np
+from progressmonitor import ProgressMonitor, NullMonitor
+
+from orangecontrib.sma.index import (BaseIndex, Index, Preview, SearchCancelled, SearchProgress, fingerprint,
+                                     get_index_registry, log)
+
+# indexes of the shards opened in this (worker) process, {directory: Index}
+_OPEN_SHARDS = {}
+_MAX_OPEN_SHARDS = 256
+
+
+def _open_shard(directory) -> Index:
+    ix = _OPEN_SHARDS.get(directory)
+    if ix is None:
+        if len(_OPEN_SHARDS) >= _MAX_OPEN_SHARDS:
+            _OPEN_SHARDS.clear()
+        ix = _OPEN_SHARDS[directory] = Index(None, directory=directory)
+    return ix
+
+
+def _build_shard(directory, tokens, limitmb):
+    # remove a shard of an earlier (different) partitioning of the corpus
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    return Index(SimpleNamespace(tokens=tokens), procs=1, limitmb=limitmb, directory=directory).build_seconds
+
+
+def _read_fingerprint(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _shard_rows(directory, query):
+    return _open_shard(directory)._search_rows(query)
+
+
+def _shard_frequencies(directory, queries):
+    return _open_shard(directory)._frequencies_list(queries)
+
+
+def _shard_spans(directory, query):
+    return _open_shard(directory)._match_spans(query)
+
+
+class ShardedIndex(BaseIndex):
+    """Index partitioned into whoosh indexes of row ranges (shards), see the module documentation"""
+
+    engine = "sharded"
+    storage = "disk"
+    # bitmaps would need a round trip to the workers per term, so queries are evaluated by the shards
+    boolean_mode = "engine"
+    # number of documents per shard if the number of shards is not given
+    docs_per_shard = 500000
+
+    def __init__(self, corpus, shards=None, procs=2, limitmb=256, directory=None, monitor: ProgressMonitor = None,
+                 **kargs):
+        """
+        :param corpus: The corpus (or other object with tokens) to index
+        :param shards: Number of shards, by default one per docs_per_shard documents
+        :param procs: Number of worker processes used to build and search the shards
+        :param directory: If given, store the shards in subdirectories of this directory (and reopen them if the
+                          directory contains shards of the same documents, see index.fingerprint). Otherwise, the
+                          shards are stored in a temporary directory.
+        :param monitor: ProgressMonitor to report the indexing progress (in documents) to
+        """
+        start = time.perf_counter()
+        self.tokens = corpus.tokens
+        self.procs = max(1, procs)
+        n = len(self.tokens)
+        if directory is None:
+            self.tempdir = TemporaryDirectory(prefix="orange3sma_shards")
+            directory = self.tempdir.name
+        self.directory = directory
+        bounds_file = os.path.join(directory, "bounds.npy")
+        # the fingerprint of the documents is written when all shards are built
+        fingerprint_file = os.path.join(directory, "fingerprint")
+        key = fingerprint(self.tokens)
+        if os.path.exists(bounds_file) and _read_fingerprint(fingerprint_file) == key:
+            self.bounds = np.load(bounds_file)
+        else:
+            if os.path.exists(fingerprint_file):
+                os.remove(fingerprint_file)
+            shards = shards or max(1, math.ceil(n / self.docs_per_shard))
+            self.bounds = np.array([round(i * n / shards) for i in range(shards + 1)], dtype=np.int64)
+            self._build(limitmb, monitor or NullMonitor())
+            np.save(bounds_file, self.bounds)
+            with open(fingerprint_file, "w") as f:
+                f.write(key)
+        self.shard_directories = [os.path.join(directory, "shard_{}".format(i)) for i in range(len(self.bounds) - 1)]
+        # the shards are also opened in this process to parse queries, make previews and get term statistics
+        self.shards = [Index(None, directory=d) for d in self.shard_directories]
+        self._pool = None
+        self.build_seconds = time.perf_counter() - start
+        log.info("Indexed {} documents in {} shards in {:.2f}s".format(n, len(self.shards), self.build_seconds))
+
+    def _build(self, limitmb, monitor):
+        """Build the shards in parallel, each in its own process"""
+        n_shards = len(self.bounds) - 1
+        n = len(self.tokens)
+        procs = min(self.procs, n_shards)
+        with get_index_registry().reserve(procs * limitmb), \
+                monitor.task(n, "Indexing {} documents in {} shards".format(n, n_shards)):
+            with ProcessPoolExecutor(max_workers=procs) as pool:
+                futures = {pool.submit(_build_shard, os.path.join(self.directory, "shard_{}".format(i)),
+                                       list(self.tokens[start:end]), limitmb): i
+                           for i, (start, end) in enumerate(zip(self.bounds, self.bounds[1:]))}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    i = futures[future]
+                    future.result()
+                    monitor.update(int(self.bounds[i + 1] - self.bounds[i]),
+                                   "Indexed shard {}/{}".format(done, n_shards))
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        """The worker processes that search the shards, started when first used and stopped with the index"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=min(self.procs, len(self.shards)))
+            weakref.finalize(self, self._pool.shutdown, False)
+        return self._pool
+
+    def _gather(self, function, args, progress: SearchProgress = None, on_done=None, results=None):
+        """
+        Run function(*a) for each a in args in the pool, polling progress for cancellation while waiting
+        :param on_done: called with the index in args and the result of each completed call
+        :param results: passed to SearchCancelled if the search is cancelled
+        :return: the list of results, in the order of args
+        """
+        progress = progress or SearchProgress()
+        futures = {self.pool.submit(function, *a): i for i, a in enumerate(args)}
+        gathered = [None] * len(args)
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures[future]
+                    gathered[i] = future.result()
+                    if on_done is not None:
+                        on_done(i, gathered[i])
+                progress.check(results)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+        return gathered
+
+    def _free(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self.shards = []
+        super()._free()
+
+    @property
+    def schema(self):
+        return self.shards[0].schema
+
+    def _expand_terms(self, q):
+        return sorted(set().union(*(shard._expand_terms(q) for shard in self.shards)))
+
+    def _search_rows(self, query: str) -> np.ndarray:
+        return self._evaluate(query)
+
+    def _evaluate(self, query: str, progress: SearchProgress = None) -> np.ndarray:
+        progress = progress or SearchProgress()
+        progress.check()
+        rows = self._gather(_shard_rows, [(d, query) for d in self.shard_directories], progress)
+        return np.concatenate([r + offset for r, offset in zip(rows, self.bounds)])
+
+    def _frequencies_list(self, queries, workers=1, progress: SearchProgress = None):
+        # workers is ignored: the shards are searched by the worker processes of the pool
+        progress = progress or SearchProgress()
+        n_shards = len(self.shards)
+        # a few chunks of queries per worker, so progress can be reported while searching
+        chunksize = math.ceil(len(queries) / (self.procs * 4))
+        chunks = list(range(0, len(queries), chunksize))
+        results = [None] * len(queries)
+        # {chunk: results of each shard}, until all shards searched the chunk
+        pending = {}
+
+        def merge(task, shard_results):
+            c, s = divmod(task, n_shards)
+            chunk = pending.setdefault(c, [None] * n_shards)
+            chunk[s] = shard_results
+            if any(r is None for r in chunk):
+                return
+            del pending[c]
+            for j in range(len(chunk[0])):
+                rows = np.concatenate([r[j][0] + offset for r, offset in zip(chunk, self.bounds)])
+                freqs = np.concatenate([r[j][1] for r in chunk])
+                results[chunks[c] + j] = (rows, freqs)
+            progress.done(len(chunk[0]))
+
+        args = [(d, queries[i:i + chunksize]) for i in chunks for d in self.shard_directories]
+        try:
+            self._gather(_shard_frequencies, args, progress, on_done=merge, results=results)
+        except SearchCancelled as e:
+            e.results = results
+            raise
+        return results
+
+    def _match_spans(self, query: str):
+        spans = self._gather(_shard_spans, [(d, query) for d in self.shard_directories])
+        rows = np.concatenate([r + offset for (r, _), offset in zip(spans, self.bounds)])
+        doc, start, end = (np.concatenate(x) for x in zip(*((d + offset, st, en)
+                                                          for (_, (d, st, en)), offset in zip(spans, self.bounds))))
+        return rows, (doc, start, end)
+
+    def _preview(self, query: str, k, deadline, mask=None) -> Preview:
+        # search the shards in row order (in this process) until k rows are found, extrapolating the number of
+        # matches in the shards searched so far if not all shards were searched
+        rows, found, total = [], 0, 0
+        for shard, start, end in zip(self.shards, self.bounds, self.bounds[1:]):
+            p = shard._preview(query, k - found, deadline, None if mask is None else mask[start:end])
+            rows.append(p.rows + start)
+            found += len(p.rows)
+            total += p.estimated_total
+            timeout = deadline is not None and time.perf_counter() > deadline
+            if end < self.n_docs and (not p.exact or found >= k or timeout):
+                return Preview(np.concatenate(rows), int(round(total * self.n_docs / end)), False)
+        return Preview(np.concatenate(rows), total, True)
+
+    def _term_arrays(self):
+        # merge the term statistics of the shards
+        arrays = [shard.term_arrays() for shard in self.shards]
+        terms, inverse = np.unique(np.concatenate([a[0] for a in arrays]), return_inverse=True)
+        docfreq = np.bincount(inverse, weights=np.concatenate([a[1] for a in arrays]), minlength=len(terms))
+        termfreq = np.bincount(inverse, weights=np.concatenate([a[2] for a in arrays]), minlength=len(terms))
+        return terms, docfreq.astype(np.int64), termfreq.astype(np.int64)
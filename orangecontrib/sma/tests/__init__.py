@@ -0,0 +1,16 @@
+import os
+import unittest
+
+
+def suite(loader=None, pattern='test*.py'):
+    test_dir = os.path.dirname(__file__)
+    if loader is None:
+        loader = unittest.TestLoader()
+    if pattern is None:
+        pattern = 'test*.py'
+    top_level_dir = os.path.dirname(os.path.dirname(os.path.dirname(test_dir)))
+    return unittest.TestSuite([loader.discover(test_dir, pattern, top_level_dir)])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,32 @@
+import unittest
+from contextlib import redirect_stderr
+from io import StringIO
+
+from orangecontrib.sma.batch import main, parse_field_filters, parse_query
+
+
+class BatchTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_query("tax# tax OR taxes"), ("tax", "tax OR taxes"))
+        self.assertEqual(parse_query("tax"), ("tax", "tax"))
+        self.assertEqual(parse_field_filters("Medium=NRC, Trouw; Year=2018"),
+                         {"Medium": ["NRC", "Trouw"], "Year": ["2018"]})
+        self.assertRaises(ValueError, parse_field_filters, "Medium")
+
+    def assertUsageError(self, argv):
+        with redirect_stderr(StringIO()), self.assertRaises(SystemExit) as cm:
+            main(argv)
+        self.assertEqual(cm.exception.code, 2)
+
+    def test_invalid_arguments(self):
+        # the arguments are checked before the corpus is loaded
+        self.assertUsageError(["corpus.pkl", "out.pkl"])
+        self.assertUsageError(["corpus.pkl", "out.pkl", "-q", "a", "--time-series", "t.tab"])
+        self.assertUsageError(["corpus.pkl", "out.pkl", "-q", "a", "--mode", "filter", "--date-field", "Date",
+                               "--time-series", "t.tab"])
+        self.assertUsageError(["corpus.pkl", "out.pkl", "-q", "a", "--mode", "count", "--context-window", "5"])
+        self.assertUsageError(["corpus.pkl", "out.pkl", "-q", "a", "--filter", "Medium"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.sma.bitmap import ARRAY_MAX, CHUNK_SIZE, Bitmap
+from orangecontrib.sma.index import Index
+from orangecontrib.sma.numpy_index import NumpyIndex
+from orangecontrib.sma.tests.utils import EquivalenceTestCase
+
+
+class BooleanModeTest(EquivalenceTestCase):
+    def test_boolean_mode(self):
+        # the bitmaps (the default mode) and the query evaluation of the engines find the same rows
+        for ix in Index(self.corpus), NumpyIndex(self.corpus):
+            self.assertSameRows(ix)
+            ix.boolean_mode = "engine"
+            self.assertSameRows(ix)
+
+
+class BitmapTest(unittest.TestCase):
+    def setUp(self):
+        rnd = np.random.RandomState(1)
+        n = 3 * CHUNK_SIZE
+        # sparse (array) and dense (bitset) chunks, and an empty chunk
+        self.n = n
+        self.x = np.unique(np.concatenate([rnd.randint(0, CHUNK_SIZE, 100),
+                                           rnd.randint(CHUNK_SIZE, 2 * CHUNK_SIZE, 3 * ARRAY_MAX)]))
+        self.y = np.unique(np.concatenate([rnd.randint(0, CHUNK_SIZE, 2 * ARRAY_MAX),
+                                           rnd.randint(CHUNK_SIZE, 2 * CHUNK_SIZE, 50),
+                                           rnd.randint(2 * CHUNK_SIZE, n, 10)]))
+
+    def test_operations(self):
+        x, y = Bitmap.from_array(self.x), Bitmap.from_array(self.y)
+        np.testing.assert_array_equal(x.to_array(), self.x)
+        self.assertEqual(len(x), len(self.x))
+        np.testing.assert_array_equal((x & y).to_array(), np.intersect1d(self.x, self.y))
+        np.testing.assert_array_equal((x | y).to_array(), np.union1d(self.x, self.y))
+        np.testing.assert_array_equal((x - y).to_array(), np.setdiff1d(self.x, self.y))
+        np.testing.assert_array_equal((y - x).to_array(), np.setdiff1d(self.y, self.x))
+        np.testing.assert_array_equal(Bitmap.union([x, y, x]).to_array(), np.union1d(self.x, self.y))
+        np.testing.assert_array_equal((Bitmap.full(self.n) - x).to_array(), np.setdiff1d(np.arange(self.n), self.x))
+        self.assertEqual(len(Bitmap.from_array([]) & x), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from orangecontrib.sma.index import get_index, Index, IndexCache, RESULT_CACHE
+from orangecontrib.sma.tests.utils import QUERIES, TokensCorpus, random_tokens
+
+
+class IndexCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        RESULT_CACHE.clear()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_appended_documents(self):
+        tokens = random_tokens(120, seed=2)
+        for positions in True, False:
+            cache = IndexCache(os.path.join(self.tempdir.name, "positional" if positions else "compact"))
+            first = get_index(TokensCorpus(tokens[:100]), cache=cache, storage="disk", positions=positions)
+            self.assertEqual(first.n_docs, 100)
+            # the index of the grown corpus is created by appending the 20 new documents to the cached index
+            ix = get_index(TokensCorpus(tokens), cache=cache, storage="disk", positions=positions)
+            self.assertEqual(ix.n_docs, 120)
+            self.assertEqual(ix.positions, positions)
+            expected = Index(TokensCorpus(tokens))
+            queries = [q for q in QUERIES if positions or '"' not in q]
+            np.testing.assert_allclose(ix.search_many(queries).toarray(), expected.search_many(queries).toarray())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import math
+import unittest
+from collections import Counter
+
+import numpy as np
+
+from orangecontrib.sma.index import Index
+from orangecontrib.sma.numpy_index import NumpyIndex
+from orangecontrib.sma.tests.utils import TokensCorpus, random_tokens
+
+
+def phrase_coverage(doc_tokens, phrase, window):
+    """Boolean masks of the tokens of a document in the window of a match of the phrase, and in a match"""
+    covered = np.zeros(len(doc_tokens), dtype=bool)
+    matched = np.zeros(len(doc_tokens), dtype=bool)
+    for i in range(len(doc_tokens) - len(phrase) + 1):
+        if doc_tokens[i:i + len(phrase)] == phrase:
+            covered[max(0, i - window):i + len(phrase) + window] = True
+            matched[i:i + len(phrase)] = True
+    return covered, matched
+
+
+def phrase_windows(tokens, phrase, window):
+    """The merged (doc, start, end) windows of the matches of a phrase, by marking the tokens in any window"""
+    windows = []
+    for doc, doc_tokens in enumerate(tokens):
+        covered, _ = phrase_coverage(doc_tokens, phrase, window)
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], covered, [False]])))
+        windows += [(doc, int(start), int(end)) for start, end in zip(edges[::2], edges[1::2])]
+    return windows
+
+
+class ContextTest(unittest.TestCase):
+    def setUp(self):
+        self.tokens = random_tokens(100, seed=4)
+        self.corpus = TokensCorpus(self.tokens)
+
+    def test_spans(self):
+        for ix in Index(self.corpus), NumpyIndex(self.corpus):
+            for query, phrase in ("c", ["c"]), ('"a b"', ["a", "b"]):
+                for window in 0, 2, 30:
+                    doc, start, end = ix.get_context_spans(query, window)
+                    self.assertEqual(list(zip(doc.tolist(), start.tolist(), end.tolist())),
+                                     phrase_windows(self.tokens, phrase, window))
+
+    def test_get_context(self):
+        ix = Index(self.corpus)
+        windows = phrase_windows(self.tokens, ["c"], 3)
+        expected = {}
+        for doc, start, end in windows:
+            expected.setdefault(doc, []).extend(self.tokens[doc][start:end])
+        context = dict(ix.get_context("c", 3))
+        self.assertEqual(context, expected)
+        self.assertEqual(list(ix.context_tokens("c", 3).rows), sorted(expected))
+
+    def test_context_tokens(self):
+        context = Index(self.corpus).context_tokens("c", 3)
+        items = list(context)
+        # subsets of the lazy tokens slice the same windows
+        self.assertEqual(list(context[::2]), items[::2])
+        self.assertEqual(list(context[[3, 1]]), [items[3], items[1]])
+        mask = np.arange(len(context)) % 3 == 0
+        self.assertEqual(list(context[mask]), [t for t, m in zip(items, mask) if m])
+        self.assertEqual(context[-1], items[-1])
+        self.assertEqual(list(np.asarray(context)), items)
+
+
+class CollocationTest(unittest.TestCase):
+    def setUp(self):
+        self.tokens = random_tokens(100, seed=5)
+        self.corpus = TokensCorpus(self.tokens)
+
+    def expected_counts(self, phrase, window):
+        """Count the tokens in the windows of the matches of phrase (except the matches) one by one"""
+        counts = Counter()
+        for doc_tokens in self.tokens:
+            covered, matched = phrase_coverage(doc_tokens, phrase, window)
+            counts.update(t for t, c, m in zip(doc_tokens, covered, matched) if c and not m)
+        return counts
+
+    def test_window_counts(self):
+        for ix in Index(self.corpus), NumpyIndex(self.corpus):
+            for query, phrase in ("c", ["c"]), ('"a b"', ["a", "b"]):
+                for window in 1, 5:
+                    terms, scores = ix.collocations(query, window)
+                    self.assertEqual(dict(zip(terms.tolist(), scores["window_count"].tolist())),
+                                     dict(self.expected_counts(phrase, window)))
+
+    def test_scores(self):
+        terms, scores = Index(self.corpus).collocations("c", 3)
+        frequency = Counter(t for doc_tokens in self.tokens for t in doc_tokens)
+        total = sum(frequency.values())
+        window_size = sum(self.expected_counts(["c"], 3).values())
+        for i, term in enumerate(terms):
+            observed = scores["window_count"][i]
+            self.assertEqual(scores["frequency"][i], frequency[term])
+            expected = window_size * frequency[term] / total
+            self.assertAlmostEqual(scores["expected"][i], expected)
+            self.assertAlmostEqual(scores["pmi"][i], math.log2(observed / expected))
+            # G2 of the 2x2 table of (in a window or not) x (this term or another term)
+            table = [[observed, window_size - observed],
+                     [frequency[term] - observed, total - window_size - frequency[term] + observed]]
+            rows, cols = [sum(r) for r in table], [sum(c) for c in zip(*table)]
+            g2 = 2 * sum(table[r][c] * math.log(table[r][c] * total / (rows[r] * cols[c]))
+                         for r in range(2) for c in range(2) if table[r][c])
+            self.assertAlmostEqual(scores["log_likelihood"][i], g2)
+
+
+if __name__ == '__main__':
+    unittest.main()
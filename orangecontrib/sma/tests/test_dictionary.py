@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.sma.dictionary_matcher import dictionary_frequencies, document_chunks, parse_simple_query
+from orangecontrib.sma.index import get_index_registry, intern_tokens, Index
+from orangecontrib.sma.numpy_index import NumpyIndex
+from orangecontrib.sma.tests.utils import EquivalenceTestCase
+
+# dictionaries of plain terms and phrases with weights, which can be counted without parsing (see dictionary_matcher)
+DICTIONARY = ['a', 'a^2 OR b', '"a b"^0.5 OR c', '"b"^3', 'a OR a', '"a a"', '"a b c"^2 OR zzz', 'test OR "d e"^1.5']
+
+
+class DictionaryTest(EquivalenceTestCase):
+    def test_dictionary(self):
+        for ix in Index(self.corpus), NumpyIndex(self.corpus):
+            ix.min_dictionary_size = 0
+            self.assertIsNotNone(ix._simple_dictionary(DICTIONARY))
+            self.assertSameCounts(ix, DICTIONARY)
+
+    def test_chunks(self):
+        # the counts do not depend on how the documents are divided into chunks, or whether the tokens are interned
+        expected = self.whoosh.search_many(DICTIONARY).toarray()
+        patterns = [parse_simple_query(q) for q in DICTIONARY]
+        tokens = self.corpus.tokens
+        for interned in None, intern_tokens(tokens):
+            for chunk_tokens in 1, 50, 10 ** 6:
+                counts = np.zeros(expected.shape)
+                for q, (rows, freqs) in enumerate(dictionary_frequencies(patterns, tokens, interned, chunk_tokens)):
+                    counts[rows, q] = freqs
+                np.testing.assert_allclose(counts, expected)
+
+    def test_document_chunks(self):
+        # documents are not split, so a document longer than max_tokens is a chunk by itself
+        self.assertEqual(document_chunks([3, 0, 5, 2, 10, 1], 5), [(0, 2), (2, 3), (3, 4), (4, 5), (5, 6)])
+        self.assertEqual(document_chunks([], 5), [])
+
+    def test_budget(self):
+        # the scan is not used if its memory does not fit in the memory budget of the index registry
+        registry = get_index_registry()
+        max_ram_mb = registry.max_ram_mb
+        registry.max_ram_mb = 0
+        try:
+            ix = NumpyIndex(self.corpus)
+            ix.min_dictionary_size = 0
+            self.assertIsNone(ix._simple_dictionary(DICTIONARY))
+            self.assertSameCounts(ix, DICTIONARY)
+        finally:
+            registry.max_ram_mb = max_ram_mb
+
+
+if __name__ == '__main__':
+    unittest.main()
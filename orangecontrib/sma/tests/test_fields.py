@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.sma.fields import FieldIndex, check_condition, filter_mask, time_buckets, to_timestamp
+from orangecontrib.sma.index import Index
+from orangecontrib.sma.tests.utils import TokensCorpus
+
+
+class FieldFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.fields = {
+            "Year": FieldIndex.from_values("numeric", [2017, 2018, None, 2018]),
+            "Date": FieldIndex.from_values("date", [to_timestamp(d) for d in
+                                                    ["2018-01-01", "2018-01-02", "2018-02-01", "2017-12-31"]]),
+            "Medium": FieldIndex.from_values("keyword", ["NRC", "Trouw", None, "NRC"]),
+        }
+
+    def test_string_values(self):
+        # the values of parsed field filters (e.g. 'Year=2018' on the command line) are strings
+        np.testing.assert_array_equal(filter_mask(self.fields, {"Year": ["2018"]}, 4), [False, True, False, True])
+        np.testing.assert_array_equal(filter_mask(self.fields, {"Year": ["2017", "2018"]}, 4),
+                                      [True, True, False, True])
+        np.testing.assert_array_equal(filter_mask(self.fields, {"Date": ["2018-01-02", "2018-02-01"]}, 4),
+                                      [False, True, True, False])
+        np.testing.assert_array_equal(filter_mask(self.fields, {"Year": ("2018", None), "Medium": ["NRC"]}, 4),
+                                      [False, False, False, True])
+
+    def test_ranges(self):
+        np.testing.assert_array_equal(filter_mask(self.fields, {"Date": ("2018-01-01", "2018-02-01")}, 4),
+                                      [True, True, False, False])
+        np.testing.assert_array_equal(filter_mask(self.fields, {"Year": (None, 2018)}, 4), [True, False, False, False])
+
+    def test_invalid_values(self):
+        self.assertRaises(ValueError, check_condition, "numeric", ["x2018"])
+        self.assertRaises(ValueError, check_condition, "date", "yesterday")
+        self.assertRaises(ValueError, check_condition, "numeric", (1, 2, 3))
+        self.assertRaises(ValueError, filter_mask, self.fields, {"Year": ["twenty"]}, 4)
+        self.assertEqual(check_condition("keyword", ["2018"]), ["2018"])
+        self.assertEqual(check_condition("numeric", ("1", None)), (1.0, None))
+
+
+class TimeBucketTest(unittest.TestCase):
+    def setUp(self):
+        # 2018-01-01 is a monday
+        self.dates = ["2018-01-01", "2018-01-07", "2018-01-08", None, "2018-01-22", "2018-02-01"]
+        self.timestamps = np.array([np.nan if d is None else to_timestamp(d) for d in self.dates])
+
+    def test_time_buckets(self):
+        codes, starts = time_buckets(self.timestamps, "week")
+        np.testing.assert_array_equal(codes, [0, 0, 1, -1, 3, 4])
+        np.testing.assert_array_equal(starts, [to_timestamp(d) for d in
+                                               ["2018-01-01", "2018-01-08", "2018-01-15", "2018-01-22", "2018-01-29"]])
+        codes, starts = time_buckets(self.timestamps, "month")
+        np.testing.assert_array_equal(codes, [0, 0, 0, -1, 0, 1])
+        np.testing.assert_array_equal(starts, [to_timestamp("2018-01-01"), to_timestamp("2018-02-01")])
+        self.assertRaises(ValueError, time_buckets, self.timestamps, "fortnight")
+
+    def test_bucket_counts(self):
+        corpus = TokensCorpus(["a a b".split(), ["b"], "a c".split(), ["a"], "c c".split(), "a b".split()])
+        ix = Index(corpus)
+        ix.add_fields({"Date": FieldIndex.from_values("date", self.timestamps),
+                       "Even": FieldIndex.from_values("keyword", ["y", "n", "y", "n", "y", "n"])})
+        result = ix.bucket_counts(["a", "b OR c"], "Date", "week")
+        np.testing.assert_array_equal(result.starts, time_buckets(self.timestamps, "week")[1])
+        # the document without a date is not counted
+        np.testing.assert_array_equal(result.counts, [[2, 2], [1, 1], [0, 0], [0, 2], [1, 1]])
+        np.testing.assert_array_equal(result.n_docs, [2, 1, 0, 1, 1])
+        result = ix.bucket_counts(["a", "b OR c"], "Date", "month", filters={"Even": ["y"]})
+        np.testing.assert_array_equal(result.counts, [[3, 4], [0, 0]])
+        np.testing.assert_array_equal(result.n_docs, [3, 0])
+        self.assertRaises(ValueError, ix.bucket_counts, ["a"], "Published")
+        self.assertRaises(ValueError, ix.bucket_counts, ["a"], "Even")
+
+
+if __name__ == '__main__':
+    unittest.main()
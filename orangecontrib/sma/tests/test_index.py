@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.sma.index import get_index, Index, RESULT_CACHE
+from orangecontrib.sma.numpy_index import NumpyIndex
+from orangecontrib.sma.tests.utils import EquivalenceTestCase, QUERIES, TokensCorpus
+
+
+class IndexEquivalenceTest(EquivalenceTestCase):
+    """All engines and search modes should give the same results as the (positional) whoosh index"""
+
+    def test_numpy(self):
+        ix = NumpyIndex(self.corpus)
+        self.assertSameRows(ix)
+        self.assertSameCounts(ix)
+        self.assertEqual(list(ix.term_statistics()), list(self.whoosh.term_statistics()))
+        for q in QUERIES:
+            self.assertEqual(sorted(ix.get_context(q, 2)), sorted(self.whoosh.get_context(q, 2)), q)
+
+    def test_get_index(self):
+        for engine in "whoosh", "numpy":
+            ix = get_index(self.corpus, cache=False, engine=engine)
+            self.assertEqual(ix.engine, engine)
+            self.assertSameCounts(ix)
+
+
+class WeightTest(unittest.TestCase):
+    def test_weighted_counts(self):
+        corpus = TokensCorpus(["x x y x".split(), "y x".split(), ["y"]])
+        queries = ['x', 'x^2', 'x^2 OR y', '"x y"^3', 'x y^2']
+        # every occurrence is weighted: before, 'x^2' counted 2 + 1 + 1 = 4 in the first document
+        expected = [[3, 6, 7, 3, 5],
+                    [1, 2, 3, 0, 3],
+                    [0, 0, 1, 0, 0]]
+        for ix in Index(corpus), NumpyIndex(corpus):
+            RESULT_CACHE.clear()
+            np.testing.assert_allclose(ix.search_many(queries).toarray(), expected)
+
+    def test_negated_counts(self):
+        # negated terms only exclude documents: they are not counted, also not in the documents that do match
+        corpus = TokensCorpus(["c c a".split(), "a b a".split(), "a a c d".split(), ["d"]])
+        queries = ['a AND NOT b', 'a NOT c', 'a OR (b AND NOT c)', '(a OR b) NOT (c OR d)', 'a^2 ANDNOT c', 'NOT b']
+        expected = [[1, 0, 1, 0, 0, 0],
+                    [0, 2, 3, 3, 4, 0],
+                    [2, 0, 2, 0, 0, 0],
+                    [0, 0, 0, 0, 0, 0]]
+        for ix in Index(corpus), Index(corpus, positions=False), NumpyIndex(corpus):
+            RESULT_CACHE.clear()
+            np.testing.assert_allclose(ix.search_many(queries).toarray(), expected)
+            np.testing.assert_array_equal(ix.search_rows('NOT b'), [0, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
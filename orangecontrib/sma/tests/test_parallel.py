@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.sma.index import Index
+from orangecontrib.sma.tests.utils import EquivalenceTestCase, QUERIES
+
+
+class ParallelSearchTest(EquivalenceTestCase):
+    def test_parallel(self):
+        ix = Index(self.corpus)
+        np.testing.assert_allclose(ix.search_many(QUERIES * 2, workers=2).toarray(),
+                                   self.whoosh.search_many(QUERIES * 2).toarray())
+
+
+class SmallChunkIndex(Index):
+    # the test corpus is too small for the default chunks of 5000 documents
+    min_chunk_size = 50
+
+
+class ParallelBuildTest(EquivalenceTestCase):
+    def test_parallel_build(self):
+        for positions in True, False:
+            # each process indexes a contiguous chunk of the documents into its own segment
+            ix = SmallChunkIndex(self.corpus, procs=3, positions=positions)
+            self.assertEqual(len(ix.index._segments()), 3)
+            self.assertSameRows(ix)
+            self.assertSameCounts(ix, QUERIES if positions else [q for q in QUERIES if '"' not in q])
+
+    def test_chunk_size(self):
+        # no more processes than chunks of min_chunk_size documents
+        ix = SmallChunkIndex(self.corpus, procs=8)
+        self.assertEqual(len(ix.index._segments()), len(self.corpus) // SmallChunkIndex.min_chunk_size)
+        self.assertSameCounts(ix)
+
+
+if __name__ == '__main__':
+    unittest.main()
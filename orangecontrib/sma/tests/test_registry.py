@@ -0,0 +1,50 @@
+import unittest
+
+from orangecontrib.sma.index import Index, IndexRegistry
+from orangecontrib.sma.numpy_index import NumpyIndex
+from orangecontrib.sma.tests.utils import TokensCorpus, random_tokens
+
+
+class IndexRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.corpus = TokensCorpus(random_tokens(50))
+
+    def test_reservation(self):
+        # the write buffers of 8 indexing processes reach the default memory budget, but do not release indexes
+        registry = IndexRegistry(max_ram_mb=2048)
+        indexes = [NumpyIndex(self.corpus), NumpyIndex(self.corpus)]
+        for ix in indexes:
+            registry.register(ix)
+        with registry.reserve(8 * 256):
+            registry.enforce()
+        self.assertFalse(any(ix.released for ix in indexes))
+        self.assertEqual(len(indexes[0].search_rows("a")), len(indexes[1].search_rows("a")))
+
+    def test_budget(self):
+        registry = IndexRegistry(max_ram_mb=0)
+        first, second, third = NumpyIndex(self.corpus), NumpyIndex(self.corpus), NumpyIndex(self.corpus)
+        registry.register(first)
+        self.assertFalse(first.released)
+        with first.in_use():
+            registry.register(second)
+            self.assertFalse(first.released)
+        registry.register(third)
+        self.assertTrue(first.released)
+        self.assertTrue(second.released)
+        self.assertFalse(third.released)
+        self.assertRaises(ValueError, first.search_rows, "a")
+
+    def test_in_use(self):
+        ix = Index(self.corpus)
+        with ix.in_use():
+            ix.release()
+            self.assertFalse(ix.released)
+            self.assertTrue(len(ix.search_rows("a")))
+        self.assertFalse(ix.busy)
+        ix.release()
+        self.assertTrue(ix.released)
+        self.assertRaises(ValueError, ix.search_many, ["a"])
+
+
+if __name__ == '__main__':
+    unittest.main()
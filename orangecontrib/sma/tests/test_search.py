@@ -0,0 +1,106 @@
+import unittest
+
+import numpy as np
+from progressmonitor import ProgressMonitor
+
+from orangecontrib.sma.fields import FieldIndex
+from orangecontrib.sma.index import Index, RESULT_CACHE, SearchCancelled
+from orangecontrib.sma.numpy_index import NumpyIndex
+from orangecontrib.sma.tests.utils import QUERIES, TokensCorpus, random_tokens
+
+
+class StopExecution(Exception):
+    """Like the exception raised by the progress callback of a widget whose task was cancelled"""
+
+
+class CancellationTest(unittest.TestCase):
+    queries = QUERIES[:10]
+
+    def setUp(self):
+        self.corpus = TokensCorpus(random_tokens(100))
+        RESULT_CACHE.clear()
+
+    def search_cancelled(self, ix, cancel_at, raising):
+        """Cancel the search once cancel_at queries are searched, with a listener that raises if raising"""
+        cancelled = []
+
+        def listener(monitor):
+            if monitor.worked >= cancel_at:
+                cancelled.append(True)
+            if cancelled and raising:
+                raise StopExecution()
+
+        monitor = ProgressMonitor()
+        monitor.add_listener(listener)
+        with self.assertRaises(SearchCancelled) as cm:
+            ix.search_many(self.queries, monitor=monitor, should_break=lambda: bool(cancelled))
+        return cm.exception
+
+    def test_cancel(self):
+        for ix in Index(self.corpus), NumpyIndex(self.corpus):
+            expected = ix.search_many(self.queries).toarray()
+            for cancel_at, raising in (3, False), (3, True), (len(self.queries), True):
+                RESULT_CACHE.clear()
+                e = self.search_cancelled(ix, cancel_at, raising)
+                # the counts of the completed queries are kept, also if the listener raised
+                self.assertEqual(e.completed.sum(), cancel_at)
+                np.testing.assert_allclose(e.partial.toarray()[:, e.completed], expected[:, e.completed])
+                self.assertEqual(e.partial[:, ~e.completed].nnz, 0)
+
+    def test_continue(self):
+        # the completed queries are cached, so searching again continues where the search was stopped
+        ix = Index(self.corpus)
+        self.search_cancelled(ix, 3, True)
+        monitor = ProgressMonitor()
+        updates = []
+        monitor.add_listener(lambda m: updates.append(m.worked))
+        ix.search_many(self.queries, monitor=monitor)
+        self.assertEqual(updates[1], 3)
+
+
+class PreviewTest(unittest.TestCase):
+    def setUp(self):
+        self.corpus = TokensCorpus(random_tokens(100))
+        RESULT_CACHE.clear()
+
+    def test_first_rows(self):
+        for ix in Index(self.corpus), NumpyIndex(self.corpus):
+            expected = ix.search_rows("a")
+            RESULT_CACHE.clear()
+            preview = ix.preview("a", k=5)
+            np.testing.assert_array_equal(preview.rows, expected[:5])
+            # the whoosh index stops after k rows and estimates the total
+            self.assertEqual(preview.exact, isinstance(ix, NumpyIndex))
+            self.assertGreater(preview.estimated_total, 0)
+            RESULT_CACHE.clear()
+            preview = ix.preview("a", k=len(expected) + 1)
+            np.testing.assert_array_equal(preview.rows, expected)
+            self.assertTrue(preview.exact)
+            self.assertEqual(preview.estimated_total, len(expected))
+
+    def test_time_budget(self):
+        ix = Index(self.corpus)
+        preview = ix.preview("a OR b", k=100, time_budget=0)
+        self.assertEqual(len(preview.rows), 1)
+        self.assertFalse(preview.exact)
+
+    def test_cached(self):
+        # the preview of a query that was searched before is taken from the result cache, and is exact
+        ix = Index(self.corpus)
+        expected = ix.search_rows("a")
+        preview = ix.preview("a", k=5)
+        np.testing.assert_array_equal(preview.rows, expected[:5])
+        self.assertTrue(preview.exact)
+        self.assertEqual(preview.estimated_total, len(expected))
+
+    def test_filters(self):
+        ix = Index(self.corpus)
+        ix.add_fields({"Half": FieldIndex.from_values("keyword", ["x" if i % 2 else "y" for i in range(100)])})
+        expected = ix.search_rows("a", filters={"Half": ["x"]})
+        RESULT_CACHE.clear()
+        preview = ix.preview("a", k=3, filters={"Half": ["x"]})
+        np.testing.assert_array_equal(preview.rows, expected[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
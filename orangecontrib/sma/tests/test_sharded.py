@@ -0,0 +1,44 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from orangecontrib.sma.index import Index, RESULT_CACHE
+from orangecontrib.sma.sharded_index import ShardedIndex
+from orangecontrib.sma.tests.utils import EquivalenceTestCase, QUERIES, TokensCorpus, random_tokens
+
+
+class ShardedIndexTest(EquivalenceTestCase):
+    def test_sharded(self):
+        ix = ShardedIndex(self.corpus, shards=3, procs=2)
+        try:
+            self.assertSameRows(ix)
+            self.assertSameCounts(ix)
+        finally:
+            ix.release()
+
+    def test_reopen(self):
+        with TemporaryDirectory() as directory:
+            bounds_file = os.path.join(directory, "bounds.npy")
+            ShardedIndex(self.corpus, shards=2, procs=1, directory=directory).release()
+            built = os.stat(bounds_file).st_mtime_ns
+            # the shards of the same documents are reopened
+            ix = ShardedIndex(self.corpus, shards=2, procs=1, directory=directory)
+            self.assertEqual(os.stat(bounds_file).st_mtime_ns, built)
+            self.assertSameCounts(ix)
+            ix.release()
+            # other documents are indexed again, also if their number is the same
+            other = TokensCorpus(random_tokens(len(self.corpus), seed=4))
+            ix = ShardedIndex(other, shards=2, procs=1, directory=directory)
+            try:
+                self.assertNotEqual(os.stat(bounds_file).st_mtime_ns, built)
+                RESULT_CACHE.clear()
+                np.testing.assert_allclose(ix.search_many(QUERIES).toarray(),
+                                           Index(other).search_many(QUERIES).toarray())
+            finally:
+                ix.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
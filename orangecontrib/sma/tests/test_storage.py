@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.sma import index
+from orangecontrib.sma.index import attach_subset_index, choose_storage, get_index, Index, IndexView
+from orangecontrib.sma.tests.utils import EquivalenceTestCase, QUERIES, TokensCorpus
+
+# queries that can be counted by a compact index (without positions)
+COMPACT_QUERIES = [q for q in QUERIES if '"' not in q]
+
+
+class RamStorageTest(EquivalenceTestCase):
+    def test_ram_storage(self):
+        ix = Index(self.corpus, storage="ram")
+        self.assertIsNone(ix.directory)
+        self.assertSameRows(ix)
+        self.assertSameCounts(ix)
+        # RAM indexes cannot be searched by worker processes, so the queries are searched in this process
+        np.testing.assert_allclose(ix.search_many(QUERIES, workers=2).toarray(),
+                                   self.whoosh.search_many(QUERIES).toarray())
+
+    def test_choose_storage(self):
+        self.assertEqual(choose_storage(self.corpus.tokens), "ram")
+        self.assertEqual(get_index(TokensCorpus(list(self.corpus.tokens)), cache=False).storage, "ram")
+        max_ram_index_mb = index.MAX_RAM_INDEX_MB
+        index.MAX_RAM_INDEX_MB = 0
+        try:
+            self.assertEqual(choose_storage(self.corpus.tokens), "disk")
+        finally:
+            index.MAX_RAM_INDEX_MB = max_ram_index_mb
+
+
+class CompactIndexTest(EquivalenceTestCase):
+    def test_compact(self):
+        # counts without phrases are computed from the postings of the compact index
+        ix = Index(self.corpus, positions=False)
+        self.assertSameCounts(ix, COMPACT_QUERIES)
+        self.assertFalse(ix.positions)
+        self.assertSameRows(ix)
+
+    def test_upgrade(self):
+        ix = Index(self.corpus, positions=False)
+        compact_id = ix.cache_id
+        compact = ix.search_many(COMPACT_QUERIES).toarray()
+        ix.require_positions()
+        self.assertTrue(ix.positions)
+        # results of the compact index are not served from the result cache after the upgrade
+        self.assertNotEqual(ix.cache_id, compact_id)
+        np.testing.assert_allclose(ix.search_many(COMPACT_QUERIES).toarray(), compact)
+        self.assertSameCounts(ix)
+
+    def test_subset_positions(self):
+        # get_index of a subset reuses the view on the compact index of the corpus, and upgrades its parent
+        corpus = TokensCorpus(list(self.corpus.tokens))
+        get_index(corpus, cache=False, storage="disk", positions=False)
+        rows = np.arange(0, len(corpus), 2)
+        subset = attach_subset_index(corpus, TokensCorpus(list(corpus.tokens[rows])), rows)
+        ix = get_index(subset, cache=False)
+        self.assertIsInstance(ix, IndexView)
+        self.assertTrue(ix.parent.positions)
+        expected = Index(subset).search_many(QUERIES).toarray()
+        np.testing.assert_allclose(ix.search_many(QUERIES).toarray(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.sma.index import attach_subset_index, get_index, Index, IndexView
+from orangecontrib.sma.tests.utils import QUERIES, TokensCorpus, random_tokens
+
+
+class IndexViewTest(unittest.TestCase):
+    def setUp(self):
+        self.tokens = random_tokens(120, seed=3)
+        self.corpus = TokensCorpus(self.tokens[:100])
+        self.parent = get_index(self.corpus, cache=False, storage="disk")
+
+    def assertSameResults(self, ix, corpus):
+        expected = Index(corpus)
+        np.testing.assert_allclose(ix.search_many(QUERIES).toarray(), expected.search_many(QUERIES).toarray())
+        for q in QUERIES:
+            np.testing.assert_array_equal(ix.search_rows(q), expected.search_rows(q), err_msg=q)
+
+    def test_get_index(self):
+        # get_index of a subset reuses the view attached by attach_subset_index instead of reindexing
+        rows = np.arange(99, -1, -3)
+        subset = attach_subset_index(self.corpus, TokensCorpus([self.tokens[i] for i in rows]), rows)
+        ix = get_index(subset, cache=False)
+        self.assertIsInstance(ix, IndexView)
+        self.assertIs(ix.parent, self.parent)
+        self.assertSameResults(ix, subset)
+        # a subset of the subset is a view on the same parent
+        sub_rows = np.arange(0, len(subset), 2)
+        nested = attach_subset_index(subset, TokensCorpus(list(subset.tokens[sub_rows])), sub_rows)
+        ix = get_index(nested, cache=False)
+        self.assertIs(ix.parent, self.parent)
+        self.assertSameResults(ix, nested)
+
+    def test_parent_grows(self):
+        rows = np.arange(0, 100, 4)
+        subset = attach_subset_index(self.corpus, TokensCorpus([self.tokens[i] for i in rows]), rows)
+        view = get_index(subset, cache=False)
+        # adding documents to the corpus appends them to its index
+        self.corpus._tokens = TokensCorpus(self.tokens).tokens
+        self.assertIs(get_index(self.corpus, cache=False, storage="disk"), self.parent)
+        self.assertEqual(self.parent.n_docs, 120)
+        self.assertTrue(view.stale)
+        self.assertRaises(ValueError, view.search_rows, "a")
+        # get_index recreates the view for the grown parent
+        ix = get_index(subset, cache=False)
+        self.assertIsNot(ix, view)
+        self.assertFalse(ix.stale)
+        self.assertSameResults(ix, subset)
+
+
+if __name__ == '__main__':
+    unittest.main()
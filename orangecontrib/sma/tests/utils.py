@@ -0,0 +1,56 @@
+import random
+import unittest
+
+import numpy as np
+
+from orangecontrib.sma.index import Index, RESULT_CACHE
+
+WORDS = "a b c d e ab abc bd test tests tester".split()
+
+# the Query Search syntax: terms, weights, phrases, prefixes, wildcards and boolean operators
+QUERIES = ['a', 'a^2', 'a^2 OR b^3', '"a b"^2', '"a b" OR c^2', 'a AND b', 'a b', 'a NOT c', 'a*', 'te*', 't?st',
+           't*s*', '(a OR d)^2', 'a^2 OR "a b"', 'a^0.5 b^2', '"a b c"', 'a OR (b AND NOT c)',
+           '(a OR b) NOT (c OR d)', 'zzz', 'zzz OR a', '"a zzz"', 'test^1.5 OR tests^-1', 'a ANDMAYBE b',
+           '(a b) OR c^2', '"a b"~3', '"a b c"~4^2', '"a a"~2', '"b a"~5 OR c', '"test a"~2 AND NOT b']
+
+
+class TokensCorpus(object):
+    """The part of a Corpus used by the index: its tokens"""
+
+    def __init__(self, tokens):
+        self._tokens = np.empty(len(tokens), dtype=object)
+        for i, doc_tokens in enumerate(tokens):
+            self._tokens[i] = doc_tokens
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+def random_tokens(n_docs, seed=1):
+    rnd = random.Random(seed)
+    return [[rnd.choice(WORDS) for _ in range(rnd.randint(0, 30))] for _ in range(n_docs)]
+
+
+class EquivalenceTestCase(unittest.TestCase):
+    """Base class for tests comparing the results of an index with those of the (positional) whoosh index"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus = TokensCorpus(random_tokens(200))
+        cls.whoosh = Index(cls.corpus)
+
+    def setUp(self):
+        RESULT_CACHE.clear()
+
+    def assertSameRows(self, ix, queries=QUERIES):
+        for q in queries:
+            np.testing.assert_array_equal(ix.search_rows(q), self.whoosh.search_rows(q), err_msg=q)
+
+    def assertSameCounts(self, ix, queries=QUERIES):
+        expected = self.whoosh.search_many(queries).toarray()
+        RESULT_CACHE.clear()
+        np.testing.assert_allclose(ix.search_many(queries).toarray(), expected)
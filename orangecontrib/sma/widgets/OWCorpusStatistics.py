@@ -13,6 +13,8 @@ from progressmonitor import monitored, ProgressMonitor
 
 from orangecontrib.text import Corpus
 
+from orangecontrib.sma.index import intern_tokens, term_counts
+
 
 def _create_table(words, scores: Mapping[str, np.array]) -> Table:
     """
@@ -31,21 +33,38 @@ def _create_table(words, scores: Mapping[str, np.array]) -> Table:
 
 
 @monitored(100)
-def get_counts(corpus: Corpus, monitor: ProgressMonitor) -> Tuple[Mapping[str, int], Mapping[str, int]]:
+def get_term_arrays(corpus: Corpus, monitor: ProgressMonitor) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the words of the corpus with their frequencies and document frequencies as aligned arrays.
+    If the corpus is indexed (e.g. by Query Search), the (cached) term statistics of the index are used
+    :return: (words, tf, df) arrays
+    """
+    ix = getattr(corpus, "_orange3sma_index", None)
+    if ix is not None and ix.tokens is corpus._tokens and not ix.released:
+        monitor.update(100, "Getting word counts from index")
+        words, df, tf = ix.term_arrays()
+        return words, tf, df
     monitor.update(0, "Getting tokens")
     tokens = corpus.tokens  # forces tokens to be created
-    n = len(tokens)
-    tf, df = {}, {}  # tf: {word : freq}, df: {word: {doc_i, ...}}
     monitor.update(50, "Counting words")
-    with monitor.subtask(50) as sm:
-        sm.begin(n)
-        for i, doc_tokens in enumerate(tokens):
-            sm.update(message="Counting words {i}/{n}".format(**locals()))
-            for t in doc_tokens:
-                df.setdefault(t, set()).add(i)
-                tf[t] = tf.get(t, 0) + 1
-        df = {w: len(df[w]) for w in df}
-        return tf, df
+    words, token_ids, doc_ptr = intern_tokens(tokens)
+    df, tf = term_counts(words, token_ids, doc_ptr)
+    return words, tf, df
+
+
+@monitored(100)
+def get_counts(corpus: Corpus, monitor: ProgressMonitor) -> Tuple[Mapping[str, int], Mapping[str, int]]:
+    words, tf, df = get_term_arrays(corpus, monitor)
+    words = words.tolist()
+    return dict(zip(words, tf.tolist())), dict(zip(words, df.tolist()))
+
+
+def _align(words, values, all_words):
+    """Get the values for all_words (sorted), with 0 for words that are not in (sorted) words"""
+    result = np.zeros(len(all_words), dtype=values.dtype)
+    idx = np.searchsorted(all_words, words)
+    result[idx] = values
+    return result
 
 
 def _relfreq(c):
@@ -55,14 +74,13 @@ def _relfreq(c):
 
 @monitored(100)
 def compare(corpus: Corpus, reference_corpus: Corpus, monitor: ProgressMonitor):
-    tf1, df1 = get_counts(corpus, monitor.submonitor(40))
-    tf2, df2 = get_counts(reference_corpus, monitor.submonitor(40))
+    words1, tf1, df1 = get_term_arrays(corpus, monitor.submonitor(40))
+    words2, tf2, df2 = get_term_arrays(reference_corpus, monitor.submonitor(40))
 
-    words = list(set(df1.keys()) | set(df2.keys()))
-    counts = np.fromiter((tf1.get(t, 0) for t in words), int)
-    docfreqs = np.fromiter((df1.get(t, 0) for t in words), int)
-    refcounts = np.fromiter((tf2.get(t, 0) for t in words), int)
-    refdocfreqs = np.fromiter((df2.get(t, 0) for t in words), int)
+    # the words are sorted, so the counts can be aligned on their union with searchsorted
+    words = np.union1d(words1, words2)
+    counts, docfreqs = _align(words1, tf1, words), _align(words1, df1, words)
+    refcounts, refdocfreqs = _align(words2, tf2, words), _align(words2, df2, words)
 
     relc, relcr = _relfreq(counts), _relfreq(refcounts)
     over = relc / relcr
@@ -79,11 +97,7 @@ def compare(corpus: Corpus, reference_corpus: Corpus, monitor: ProgressMonitor):
 
 @monitored(100)
 def frequencies(corpus, monitor):
-    tf, df = get_counts(corpus, monitor.submonitor(90))
-
-    words = list(tf.keys())
-    counts = np.fromiter((tf.get(t, 0) for t in words), int)
-    docfreqs = np.fromiter((df.get(t, 0) for t in words), int)
+    words, counts, docfreqs = get_term_arrays(corpus, monitor.submonitor(90))
     reldocfreqs = _relfreq(counts)
 
     monitor.update(10)
@@ -7,6 +7,8 @@ from Orange.widgets import gui
 from Orange.widgets.settings import Setting
 from Orange.widgets.widget import OWWidget, Input, Output, Msg
 
+from orangecontrib.sma.dictionary import Dictionary
+
 class OWDictionary(OWWidget):
     name = "Dictionary"
     description = "Create a dictionary"
@@ -267,70 +269,6 @@ class OWDictionary(OWWidget):
             self.label_in, self.query_in = [None], [None]
 
 
-
-class Dictionary(Orange.data.Table):
-    """Internal class for storing a dictionary."""
-
-    def attrnames(self):
-        return [x.name for x in self.domain.attributes]
-
-    def metanames(self):
-        return [x.name for x in self.domain.metas]
-
-    def get_column(self, name):
-        for i, a in enumerate(self.attrnames()):
-            if a == name:   
-                return [str(v[0]) for v in self[:,i]]   
-        for i, m in enumerate(self.metanames()):
-            if m == name:
-                return self.metas[:,i]  ## metas is in numpy format, so this already returns simple list
-
-    def get_dictionary(self, label_col='label', query_col='query'):
-        label = self.get_column(label_col)
-        query = self.get_column(query_col)
-        return [list(a) for a in zip(label,query)]
-
-    def import_dictionary(self, label_col='label', query_col='query', weight_col='weight', add_quotes=True):
-        query = self.get_column(query_col)
-        #if label_col is None: label_col = weight_col  ## special case where weight is sentiment score
-        label = self.get_column(label_col) if label_col is not None else ["no label"] * len(query)
-        weight = self.get_column(weight_col) if weight_col is not None else [1] * len(query)
-
-        qdict = {}
-        for l, q, w in zip(label, query, weight):
-            q = clean_query(q)
-            if can_float(l):
-                l = 'positive' if float(l) > 0 else 'negative'
-            if add_quotes:
-                if not '"' in q and len(q.split()) > 1:
-                    q = '"' + q + '"'
-            else:
-                if len(q.split()) > 1:
-                    q = '(' + q + ')'
-            if can_float(w):
-                w = float(w)
-                if not w == 1:
-                    if w < 0 and not l == 'negative':
-                        l = l + ' (negative)'
-                    ## regex to add weight to (phrases wrapped in quotes) or (single terms except OR/AND/NOT)
-                    q = re.sub(r'(\"[^\"]*\")|([^ \(\)(OR)(AND)(NOT)]+)', r'\1\2^' + str(abs(w)), q)
-
-            qdict[l] = q if not l in qdict.keys() else qdict[l] + ' OR ' + q
-
-        return [[k, v] for k,v in qdict.items()]
-
-
-def can_float(x):
-    try:
-        float(x)
-        return(True)
-    except ValueError:
-        return(False)
-
-def clean_query(q):
-    q = re.sub('”|“', '"', q)
-    return q
-
 if __name__ == '__main__':
     app = QApplication([])
     widget = OWDictionary()
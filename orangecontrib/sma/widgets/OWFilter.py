@@ -1,11 +1,11 @@
-import numpy as np
-import re
+import multiprocessing
 
 import progressmonitor
 from AnyQt.QtCore import Qt
 from AnyQt.QtGui import QIntValidator, QColor
 from AnyQt.QtWidgets import QApplication, QCheckBox
 
+from Orange.data import Table
 from Orange.widgets import gui
 from Orange.widgets.settings import Setting
 from Orange.widgets.widget import OWWidget, Input, Output, Msg
@@ -14,16 +14,12 @@ from orangecontrib.text.widgets.utils.concurrent import asynchronous
 from orangecontrib.text.widgets.utils.widgets import ListEdit
 from progressmonitor import ProgressMonitor
 
-from orangecontrib.sma.index import get_index
+from orangecontrib.sma.batch import parse_field_filters, check_filters, count_queries, filter_queries
+from orangecontrib.sma.index import SearchCancelled
+from orangecontrib.sma.fields import BUCKET_INTERVALS
 from orangecontrib.sma.widgets.OWDictionary import Dictionary
 
 
-def parse_query(string):
-    m = re.match("([^#]*\w)#(.*)", string)
-    l, q = m.groups() if m else [string, string]
-    return l.strip(), q.strip()
-
-
 QUERY_MODES = ['count', 'filter']
 
 class OWQuerySearch(OWWidget):
@@ -39,6 +35,16 @@ class OWQuerySearch(OWWidget):
     dictionary_text = Setting('')
     include_unmatched = Setting(False)
     context_window = Setting('')
+    workers = Setting(1)
+    preview = Setting(False)
+    preview_size = Setting(100)
+    date_field = Setting('')
+    date_from = Setting('')
+    date_to = Setting('')
+    field_filters = Setting('')
+    aggregate_time = Setting(False)
+    sparse_counts = Setting(False)
+    bucket_interval = Setting(1)
     dictionary_on = False
     window_disabled_text = ''
 
@@ -51,14 +57,19 @@ class OWQuerySearch(OWWidget):
     class Outputs:
         sample = Output("Filtered Corpus", Corpus)
         remaining = Output("Unselected Documents", Corpus)
+        time_series = Output("Hits per Period", Table)
 
     class Error(OWWidget.Error):
         no_query = Msg('Please provide a query.')
+        invalid_filter = Msg('{}')
 
     def __init__(self):
         super().__init__()
 
         self.corpus = None
+        self.stopped_info = None
+        self.preview_info = None
+        self.filters = {}
 
         # GUI
         box = gui.widgetBox(self.controlArea, "Info")
@@ -81,13 +92,33 @@ class OWQuerySearch(OWWidget):
 
         self.count_mode_parameters = gui.vBox(query_parameter_box, self)
         gui.checkBox(self.count_mode_parameters, self, 'include_unmatched', label="Include unmatched documents")
+        gui.spin(self.count_mode_parameters, self, 'workers', 1, multiprocessing.cpu_count(),
+                 label="Worker processes")
+        gui.checkBox(self.count_mode_parameters, self, 'sparse_counts', label="Output counts as sparse features")
+        gui.checkBox(self.count_mode_parameters, self, 'aggregate_time', label="Count hits per period of date field")
+        gui.comboBox(self.count_mode_parameters, self, 'bucket_interval', items=BUCKET_INTERVALS,
+                     label="Period", orientation=Qt.Horizontal)
 
         self.filter_mode_parameters = gui.widgetBox(query_parameter_box, self)
         gui.lineEdit(self.filter_mode_parameters, self, "context_window", 'Output words in context window',
                      validator=QIntValidator())
+        gui.checkBox(self.filter_mode_parameters, self, 'preview', label="Preview only (ignores context window)")
+        gui.spin(self.filter_mode_parameters, self, 'preview_size', 1, 10000, label="Preview size")
 
         self.toggle_mode()
 
+        # filters on the (indexed) document metadata
+        filter_box = gui.vBox(self.controlArea, 'Document filters')
+        self.date_field_combo = gui.comboBox(filter_box, self, 'date_field', label='Date field',
+                                            sendSelectedValue=True, orientation=Qt.Horizontal)
+        date_box = gui.hBox(filter_box)
+        gui.lineEdit(date_box, self, 'date_from', 'From', orientation=Qt.Horizontal,
+                     tooltip='First date (inclusive), e.g. 2018-01-01')
+        gui.lineEdit(date_box, self, 'date_to', 'To', orientation=Qt.Horizontal,
+                     tooltip='Last date (exclusive), e.g. 2018-02-01')
+        gui.lineEdit(filter_box, self, 'field_filters', 'Field filters',
+                     tooltip='Only search documents with these meta values, e.g. Medium=NRC,Trouw; Section=Economy')
+
         info_box = gui.hBox(self.controlArea, 'Status')
         self.status = 'Waiting for input'
         gui.label(info_box, self, '%(status)s')
@@ -105,6 +136,12 @@ class OWQuerySearch(OWWidget):
             self.info.setText('Connect an input corpus to start querying')
             self.Outputs.sample.send(None)
         else:
+            try:
+                self.filters = self.get_filters()
+            except ValueError as e:
+                self.Error.invalid_filter(str(e))
+                return
+            self.Error.invalid_filter.clear()
             # start async search
             self.search()
 
@@ -130,6 +167,14 @@ class OWQuerySearch(OWWidget):
             self.filter_mode_parameters.setVisible(True)
             self.count_mode_parameters.setVisible(False)
 
+    def get_filters(self):
+        """Get the field filters (see orangecontrib.sma.fields) given in the widget"""
+        filters = {}
+        if self.date_field and (self.date_from or self.date_to):
+            filters[self.date_field] = (self.date_from or None, self.date_to or None)
+        filters.update(parse_field_filters(self.field_filters))
+        return check_filters(self.corpus, filters)
+
     @asynchronous
     def search(self):
         indices = [0]
@@ -139,53 +184,35 @@ class OWQuerySearch(OWWidget):
                 queries = queries + self.dictionary_text
             else:
                 queries = self.dictionary_text
+        self.stopped_info = None
+        self.preview_info = None
 
         with ProgressMonitor().task(100, 'Starting search..') as monitor:
             monitor.add_listener(self.callback)
-            index = get_index(self.corpus, monitor=monitor.submonitor(50))
-
             if QUERY_MODES[self.query_mode] == 'filter':
-                # simple search
-                query = " OR ".join('({})'.format(parse_query(q)[1]) for q in queries)
-                if not self.context_window:
-                    selected = list(index.search(query))
-                    sample = self.corpus[selected]
-                else:
-                    sample = self.corpus.copy()
-                    sample._tokens = sample._tokens.copy()
-                    selected = []
-                    for i, context in index.get_context(query, int(self.context_window)):
-                        sample._tokens[i] = context
-                        selected.append(i)
-                    sample = sample[selected]
-                o = np.ones(len(self.corpus))
-                o[selected] = 0
-                remaining = np.nonzero(o)[0]
-                remaining = self.corpus[remaining]
-            else:
-                sample = self.corpus.copy()
-                remaining = None
-                seen = set()
-                for q in queries:
-                    label, q = parse_query(q)
-                    # todo: implement as sparse matrix!
-                    scores = np.zeros(len(sample), dtype=np.float)
-
-                    for i, j in index.search(q, frequencies=True):
-                        seen.add(i)
-                        scores[i] = j
-                    scores = scores.reshape((len(sample), 1))
-                    sample.extend_attributes(scores, [label])
-                if self.include_unmatched:
-                    remaining = None
-                else:
-                    selected = list(seen)
-                    o = np.ones(len(self.corpus))
-                    o[selected] = 0
-                    remaining = np.nonzero(o)[0]
-                    remaining = self.corpus[remaining]
-                    sample = sample[selected]
-            return sample, remaining
+                try:
+                    result = filter_queries(self.corpus, queries, monitor, should_break=self.search.should_break,
+                                            context_window=self.context_window,
+                                            preview=self.preview and self.preview_size, filters=self.filters,
+                                            workers=self.workers)
+                except SearchCancelled:
+                    return None
+                if result.preview:
+                    self.preview_info = 'preview of {}{} matching documents'.format(
+                        '' if result.preview.exact else '~', result.preview.estimated_total)
+                return result.sample, result.remaining, None
+            date_field = self.date_field if self.aggregate_time else None
+            result = count_queries(self.corpus, queries, monitor, should_break=self.search.should_break,
+                                   workers=self.workers, include_unmatched=self.include_unmatched,
+                                   sparse=self.sparse_counts, filters=self.filters, date_field=date_field,
+                                   interval=BUCKET_INTERVALS[self.bucket_interval])
+            # progress is no longer reported: if the search was stopped in the meantime, the callback would raise
+            # StopExecution when the task is done, and the (partial) counts would be lost
+            monitor.remove_listener(self.callback)
+            if not result.completed.all():
+                self.stopped_info = 'stopped after {} of {} queries'.format(result.completed.sum(),
+                                                                            len(result.completed))
+            return result.sample, result.remaining, result.time_series
 
     @search.callback(should_raise=True)
     def callback(self, monitor):
@@ -199,18 +226,32 @@ class OWQuerySearch(OWWidget):
     @search.on_result
     def on_result(self, result):
         self.progressBarFinished()
+        time_series = None
         if result:
-            sample, remaining = result
-            self.info.setText('%d sampled instances' % len(sample))
+            sample, remaining, time_series = result
+            info = '%d sampled instances' % len(sample)
+            if self.stopped_info:
+                info += ' (%s)' % self.stopped_info
+            if self.preview_info:
+                info += ' (%s)' % self.preview_info
+            self.info.setText(info)
         else:
-            sample, remaning = None, None
+            sample, remaining = None, None
             self.info.setText('(no input)')
         self.Outputs.sample.send(sample)
         self.Outputs.remaining.send(remaining)
+        self.Outputs.time_series.send(time_series)
 
     @Inputs.data
     def set_data(self, corpus):
         self.corpus = corpus
+        date_fields = [var.name for var in corpus.domain.variables + corpus.domain.metas
+                       if var.is_time] if corpus is not None else []
+        self.date_field_combo.clear()
+        self.date_field_combo.addItems([''] + date_fields)
+        if self.date_field not in date_fields:
+            self.date_field = date_fields[0] if date_fields else ''
+        self.date_field_combo.setCurrentIndex(([''] + date_fields).index(self.date_field))
         self.run_search()
 
     @Inputs.dictionary
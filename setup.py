@@ -60,7 +60,12 @@ ENTRY_POINTS = {
 
      #Register widget help
     "orange.canvas.help": (
-        'html-index = orangecontrib.sma.widgets:WIDGET_HELP_PATH',)
+        'html-index = orangecontrib.sma.widgets:WIDGET_HELP_PATH',),
+
+    # Command line tool to run queries or a dictionary on a saved corpus, e.g. in batch jobs
+    'console_scripts': (
+        'orange3-sma-query = orangecontrib.sma.batch:main',
+    ),
 }
 
 NAMESPACE_PACKAGES = ["orangecontrib"]